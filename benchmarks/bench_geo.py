@@ -0,0 +1,95 @@
+"""
+Benchmarks for qolhelpers.geo.
+
+python benchmarks/bench_geo.py parse --rows 1000000
+python benchmarks/bench_geo.py index --sizes 10000 100000 1000000 10000000
+"""
+import argparse
+import time
+
+import numpy as np
+
+from qolhelpers.geo import LatLong, LatLongIndex, parse_coord_strings, haversine_distance
+
+
+def make_dms_strings(rows: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    lats = rng.uniform(-90, 90, rows)
+    deg = np.trunc(np.abs(lats)).astype(int)
+    minutes = (np.abs(lats) - deg) * 60
+    seconds = (minutes % 1) * 60
+    # The sign goes on the degrees even when they are 0, so latitudes in (-1, 0) stay negative.
+    return [f"{'-' if lat < 0 else ''}{d}° {int(m)}' {s:.4f}\""
+            for lat, d, m, s in zip(lats, deg, minutes, seconds)]
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    func(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def bench_parse(args):
+    strings = make_dms_strings(args.rows)
+    buffer = "\n".join(strings).encode("utf-8")
+    latlong = LatLong(0.0, 0.0)
+    results = {
+        "per-string (LatLong._parse_coord_str)": timed(lambda: [latlong._parse_coord_str(s) for s in strings]),
+        "bulk (list of str)": timed(parse_coord_strings, strings),
+        "bulk (numpy str array)": timed(parse_coord_strings, np.array(strings)),
+        "bulk (bytes buffer)": timed(parse_coord_strings, buffer),
+    }
+    for name, seconds in results.items():
+        print(f"{name:40s} {seconds:8.3f} s {args.rows / seconds:14,.0f} rows/s")
+
+
+def random_latlong(size: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    # Uniform on the sphere rather than uniform in degrees.
+    lats = np.degrees(np.arcsin(rng.uniform(-1, 1, size)))
+    return LatLong(lats, rng.uniform(-180, 180, size), vectorized=True)
+
+
+def brute_force_knn(points: LatLong, queries: LatLong, k: int):
+    indices = np.empty((len(queries), k), dtype=np.intp)
+    for i, (lat1, lon1) in enumerate(zip(queries.latitude, queries.longitude)):
+        distances = haversine_distance(lat1, lon1, points.latitude, points.longitude)
+        nearest = np.argpartition(distances, k - 1)[:k]
+        indices[i] = nearest[np.argsort(distances[nearest])]
+    return indices
+
+
+def bench_index(args):
+    queries = random_latlong(args.queries, seed=1)
+    brute_queries = LatLong(queries.latitude[:args.brute_queries], queries.longitude[:args.brute_queries],
+                            vectorized=True)
+    LatLongIndex(random_latlong(10))  # Keep the scikit-learn import out of the first build time.
+    print(f"{'points':>10s} {'build s':>9s} {'index us/query':>15s} {'brute us/query':>15s} {'speedup':>8s}")
+    for size in args.sizes:
+        points = random_latlong(size)
+        build = timed(lambda: LatLongIndex(points))
+        index = LatLongIndex(points)
+        index_time = timed(index.query, queries, k=args.k) / len(queries)
+        brute_time = timed(brute_force_knn, points, brute_queries, args.k) / len(brute_queries)
+        print(f"{size:10d} {build:9.3f} {index_time * 1e6:15.1f} {brute_time * 1e6:15.1f} "
+              f"{brute_time / index_time:8.0f}x")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    parse = subparsers.add_parser("parse", description="Bulk coordinate string parsing against the per-string path.")
+    parse.add_argument("--rows", type=int, default=1_000_000)
+    parse.set_defaults(func=bench_parse)
+    index = subparsers.add_parser("index", description="LatLongIndex kNN queries against a brute-force scan.")
+    index.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000, 10_000_000])
+    index.add_argument("--queries", type=int, default=10_000, help="Query points for the index.")
+    index.add_argument("--brute_queries", type=int, default=20, help="Query points for the brute-force scan.")
+    index.add_argument("-k", type=int, default=5)
+    index.set_defaults(func=bench_index)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    args.func(args)
@@ -0,0 +1,102 @@
+"""
+Benchmarks for qolhelpers.images.
+
+python benchmarks/bench_images.py decode --count 20 --width 6000 --height 4000
+python benchmarks/bench_images.py hog --count 2000
+"""
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+from skimage.feature import hog
+
+from qolhelpers.images import FEATURE_SIZE, HOG_PARAMS, read_grayscale, hog_batch, extract_features, \
+    load_images_and_extract_features, load_images_and_extract_features_batched
+
+
+def make_jpegs(directory: Path, count: int, width: int, height: int, seed: int = 0):
+    """
+    Write synthetic camera-like frames: a smooth background with noise and a few bright blobs.
+    """
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    background = (64 + 64 * np.sin(x / width * np.pi) * np.cos(y / height * np.pi)).astype(np.uint8)
+    paths = []
+    for i in range(count):
+        image = cv2.cvtColor(background, cv2.COLOR_GRAY2BGR)
+        image = cv2.add(image, rng.integers(0, 24, image.shape, dtype=np.uint8))
+        for _ in range(5):
+            center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+            cv2.circle(image, center, int(rng.integers(height // 20, height // 5)), (220, 220, 220), -1)
+        path = directory / f"frame_{i:05d}.jpg"
+        cv2.imwrite(str(path), image, [cv2.IMWRITE_JPEG_QUALITY, 90])
+        paths.append(path)
+    return paths
+
+
+def bench_decode(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = make_jpegs(Path(tmp), args.count, args.width, args.height)
+        megabytes = sum(path.stat().st_size for path in paths) / 1e6
+        modes = {
+            "full decode + resize": lambda path: cv2.resize(cv2.imread(str(path), cv2.IMREAD_GRAYSCALE),
+                                                            FEATURE_SIZE),
+            "reduced decode + resize": lambda path: cv2.resize(read_grayscale(path, FEATURE_SIZE), FEATURE_SIZE),
+        }
+        print(f"{args.count} JPEGs of {args.width}x{args.height}, {megabytes:.1f} MB")
+        for name, decode in modes.items():
+            start = time.perf_counter()
+            for path in paths:
+                decode(path)
+            seconds = time.perf_counter() - start
+            print(f"{name:28s} {args.count / seconds:8.1f} images/s {megabytes / seconds:8.1f} MB/s")
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    func(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def bench_hog(args):
+    rng = np.random.default_rng(0)
+    stack = rng.integers(0, 256, (args.count, *FEATURE_SIZE[::-1]), dtype=np.uint8)
+    results = {
+        "skimage hog per image (compute only)": timed(lambda: [hog(image, **HOG_PARAMS) for image in stack]),
+        "hog_batch (compute only)": timed(hog_batch, stack, **HOG_PARAMS),
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = make_jpegs(Path(tmp), args.count, args.width, args.height)
+        results["extract_features per image, serial"] = timed(lambda: [extract_features(path) for path in paths])
+        results["pool.map(extract_features)"] = timed(load_images_and_extract_features, paths,
+                                                      processes=args.processes)
+        results["batched + shared memory pool"] = timed(load_images_and_extract_features_batched, paths,
+                                                        batch_size=args.batch_size, processes=args.processes)
+    for name, seconds in results.items():
+        print(f"{name:40s} {seconds:8.3f} s {args.count / seconds:10.1f} images/s")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    decode = subparsers.add_parser("decode", description="Full against reduced resolution JPEG decoding.")
+    decode.add_argument("--count", type=int, default=20)
+    decode.add_argument("--width", type=int, default=6000)
+    decode.add_argument("--height", type=int, default=4000)
+    decode.set_defaults(func=bench_decode)
+    hog_parser = subparsers.add_parser("hog", description="Batched HOG engine against the per-image path.")
+    hog_parser.add_argument("--count", type=int, default=2000)
+    hog_parser.add_argument("--width", type=int, default=640)
+    hog_parser.add_argument("--height", type=int, default=480)
+    hog_parser.add_argument("--batch_size", type=int, default=64)
+    hog_parser.add_argument("--processes", type=int, default=None)
+    hog_parser.set_defaults(func=bench_hog)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    args.func(args)
@@ -0,0 +1,61 @@
+"""
+Startup latency of the qolhelpers.utils command line, per subcommand.
+
+python benchmarks/bench_startup.py --runs 5
+
+"help" is `python -m qolhelpers.utils <command> -h`, "run" runs the subcommand on an empty input so it loads all of its
+dependencies but does no work. "python" is the bare interpreter start-up, for reference.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+HEAVY_MODULES = ("cv2", "numpy", "tqdm", "skimage", "sklearn", "qolhelpers.images", "qolhelpers.geo")
+REPORT_MODULES = "import atexit, sys; atexit.register(lambda: print(' '.join(m for m in {} if m in sys.modules), " \
+                 "file=sys.stderr)); ".format(HEAVY_MODULES)
+
+
+def time_command(argv, runs: int, cwd: Path):
+    env = dict(os.environ, PYTHONPATH=str(Path(__file__).resolve().parent.parent))
+    seconds, modules = [], ""
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = subprocess.run(argv, cwd=cwd, env=env, capture_output=True, text=True)
+        seconds.append(time.perf_counter() - start)
+        modules = result.stderr.strip().splitlines()[-1] if result.stderr.strip() else ""
+    return statistics.median(seconds), modules
+
+
+def utils_command(*args):
+    code = REPORT_MODULES + "import runpy; runpy.run_module('qolhelpers.utils', run_name='__main__')"
+    return [sys.executable, "-c", code, *args]
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        (tmp / "empty").mkdir()
+        (tmp / "coords.csv").write_text("latitude,longitude\n")
+        commands = {
+            "python": [sys.executable, "-c", "pass"],
+            "-h": utils_command("-h"),
+        }
+        for command in ("copy_images", "crop_images", "detect_anomalies"):
+            commands[f"{command} help"] = utils_command(command, "-h")
+            commands[f"{command} run"] = utils_command(command, "empty", "-o", str(tmp / f"{command}.out"))
+        commands["convert_coords help"] = utils_command("convert_coords", "-h")
+        commands["convert_coords run"] = utils_command("convert_coords", "coords.csv", "-o", "converted.csv")
+        for name, argv in commands.items():
+            seconds, modules = time_command(argv, args.runs, tmp)
+            print(f"{name:24s} {seconds * 1e3:8.1f} ms  {modules}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5, help="Runs per command, the median is reported.")
+    main(parser.parse_args())
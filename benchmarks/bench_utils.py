@@ -0,0 +1,104 @@
+"""
+Benchmarks for qolhelpers.utils.
+
+python benchmarks/bench_utils.py copy --count 200 --size_mb 8
+python benchmarks/bench_utils.py find --dirs 200 --files 50
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+from qolhelpers.utils import fast_copy, copy_metadata, find_files, DirectoryIndex
+
+
+def make_files(directory: Path, count: int, size: int):
+    directory.mkdir(parents=True, exist_ok=True)
+    block = os.urandom(1 << 20)
+    paths = []
+    for i in range(count):
+        path = directory / f"file_{i:06d}.bin"
+        with open(path, "wb") as f:
+            for offset in range(0, size, len(block)):
+                f.write(block[:size - offset])
+        paths.append(path)
+    return paths
+
+
+def bench_copy(args):
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        tmp = Path(tmp)
+        paths = make_files(tmp / "source", args.count, int(args.size_mb * (1 << 20)))
+        total = sum(path.stat().st_size for path in paths)
+
+        def copy_fast(path, destination):
+            fast_copy(path, destination)
+            copy_metadata(path.stat(), destination)
+
+        engines = {"shutil.copy2": lambda path, destination: shutil.copy2(str(path), str(destination)),
+                   "fast_copy + copy_metadata": copy_fast}
+        print(f"{args.count} files, {total / 1e6:.1f} MB")
+        for name, copy in engines.items():
+            destination = tmp / name.split()[0]
+            destination.mkdir()
+            start = time.perf_counter()
+            for path in paths:
+                copy(path, destination / path.name)
+            seconds = time.perf_counter() - start
+            print(f"{name:28s} {total / seconds / 1e6:10.1f} MB/s {args.count / seconds:10.1f} files/s")
+
+
+def glob_per_extension(extensions, path):
+    # The previous discovery strategy: one recursive glob of the whole tree per extension.
+    return [file for ext in extensions for file in Path(path).rglob(f"*{ext}")]
+
+
+def bench_find(args):
+    extensions = [".jpg", ".jpeg", ".png", ".tif", ".tiff", ".bmp", ".gif", ".webp"]
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        tmp = Path(tmp)
+        for d in range(args.dirs):
+            directory = tmp / f"{d % 10:02d}" / f"dir_{d:05d}"
+            directory.mkdir(parents=True)
+            for i in range(args.files):
+                directory.joinpath(f"file_{i:05d}{extensions[i % 3]}").touch()
+        print(f"{args.dirs} directories, {args.dirs * args.files} files, {len(extensions)} extensions")
+        for name, find in {"rglob per extension": lambda: glob_per_extension(extensions, tmp),
+                           "find_files (scandir)": lambda: find_files(extensions, [tmp], recursive=True)}.items():
+            start = time.perf_counter()
+            count = len(find())
+            seconds = time.perf_counter() - start
+            print(f"{name:28s} {seconds * 1e3:10.1f} ms {count / seconds:12.0f} files/s")
+        with tempfile.TemporaryDirectory() as index_dir:
+            for run in ("cold", "warm"):
+                with DirectoryIndex(Path(index_dir) / "listing.sqlite") as index:
+                    # Trust the fresh fixture mtimes so the warm run can reuse listings.
+                    index.MTIME_SLACK_NS = 0
+                    start = time.perf_counter()
+                    count = len(list(index.find(extensions, [tmp], recursive=True)))
+                    seconds = time.perf_counter() - start
+                name = f"DirectoryIndex ({run})"
+                print(f"{name:28s} {seconds * 1e3:10.1f} ms {count / seconds:12.0f} files/s")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    copy = subparsers.add_parser("copy", description="fast_copy against shutil.copy2.")
+    copy.add_argument("--count", type=int, default=200)
+    copy.add_argument("--size_mb", type=float, default=8)
+    copy.add_argument("--dir", type=Path, default=None, help="Folder on the volume to benchmark. Default temp folder.")
+    copy.set_defaults(func=bench_copy)
+    find = subparsers.add_parser("find", description="find_files against one rglob per extension.")
+    find.add_argument("--dirs", type=int, default=200)
+    find.add_argument("--files", type=int, default=50)
+    find.add_argument("--dir", type=Path, default=None, help="Folder on the volume to benchmark. Default temp folder.")
+    find.set_defaults(func=bench_find)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    args.func(args)
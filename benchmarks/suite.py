@@ -0,0 +1,269 @@
+"""
+Reproducible benchmark suite over synthetic data, with regression checks against a stored baseline.
+
+PYTHONPATH=. python benchmarks/suite.py --scale small --save_baseline benchmarks/baseline_small.json
+PYTHONPATH=. python benchmarks/suite.py --scale small --baseline benchmarks/baseline_small.json
+PYTHONPATH=. python benchmarks/suite.py --scale medium --cases find_files parse_coord_strings
+
+All data is generated offline from fixed seeds into a temporary folder, so two runs at the same scale see identical
+inputs. Each case reports the best of --repeats timed runs and the peak traced memory of one extra run under
+tracemalloc. tracemalloc sees Python and NumPy allocations in this process only: memory used by OpenCV internals or
+by pool worker processes is not included. With --baseline, a case is flagged when its throughput drops, or its peak
+memory grows, by more than --tolerance, and the exit code is 1.
+"""
+import argparse
+import csv
+import functools
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+os.environ.setdefault("TQDM_DISABLE", "1")
+
+import numpy as np
+
+from bench_geo import make_dms_strings
+from bench_images import make_jpegs
+
+SCALES = {
+    "small": dict(images=40, width=640, height=480, dirs=10, files=2_000, coords=20_000),
+    "medium": dict(images=200, width=1280, height=960, dirs=100, files=50_000, coords=500_000),
+    "large": dict(images=1_000, width=1920, height=1440, dirs=1_000, files=500_000, coords=5_000_000),
+}
+FIND_EXTENSIONS = (".jpg", ".jpeg", ".png", ".tif", ".txt", ".json")
+# Memory growth below this is noise from allocator and interpreter state, not a regression.
+MEMORY_SLACK_BYTES = 1 << 20
+
+
+class Workspace:
+    def __init__(self, root: Path, scale: dict, workers: int):
+        """
+        Synthetic inputs for one scale, generated the first time a case asks for them.
+        """
+        self.root = root
+        self.scale = scale
+        self.workers = workers
+
+    def scratch(self, name: str) -> Path:
+        return self.root / "scratch" / name
+
+    def reset(self, name: str):
+        # Empty a scratch output folder between runs, outside the timed region.
+        path = self.scratch(name)
+        shutil.rmtree(path, ignore_errors=True)
+        path.mkdir(parents=True)
+
+    @functools.cached_property
+    def images(self):
+        directory = self.root / "images"
+        directory.mkdir()
+        return make_jpegs(directory, self.scale["images"], self.scale["width"], self.scale["height"])
+
+    @functools.cached_property
+    def tree(self) -> Path:
+        # Empty files spread over two directory levels with a mix of matching and non-matching extensions.
+        root = self.root / "tree"
+        per_dir = max(1, self.scale["files"] // self.scale["dirs"])
+        for d in range(self.scale["dirs"]):
+            directory = root / f"{d % 10:02d}" / f"dir_{d:05d}"
+            directory.mkdir(parents=True)
+            for i in range(per_dir):
+                directory.joinpath(f"file_{i:05d}{FIND_EXTENSIONS[i % len(FIND_EXTENSIONS)]}").touch()
+        return root
+
+    @functools.cached_property
+    def dms_strings(self):
+        return make_dms_strings(self.scale["coords"])
+
+    @functools.cached_property
+    def decimal_degrees(self):
+        rng = np.random.default_rng(0)
+        return rng.uniform(-90, 90, self.scale["coords"]), rng.uniform(-180, 180, self.scale["coords"])
+
+    @functools.cached_property
+    def coords_csv(self) -> Path:
+        path = self.root / "coords.csv"
+        longitudes = make_dms_strings(self.scale["coords"], seed=1)
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["latitude", "longitude"])
+            writer.writerows(zip(self.dms_strings, longitudes))
+        return path
+
+
+def utils_args(**kwargs):
+    defaults = dict(verbose=False, recursive=False, dry_run=False, index=None)
+    defaults.update(kwargs)
+    return argparse.Namespace(**defaults)
+
+
+# Each case takes the workspace and returns a zero-argument callable to time, the number of items it processes and
+# optionally a callable run before every timed run.
+def case_find_files(ws: Workspace):
+    from qolhelpers.utils import find_files, get_extensions_for_type
+    extensions = get_extensions_for_type("image")
+    return lambda: find_files(extensions, [ws.tree], recursive=True, num_threads=ws.workers), \
+        len(find_files(extensions, [ws.tree], recursive=True))
+
+
+def case_copy_images(ws: Workspace):
+    from qolhelpers.utils import copy_images
+
+    def run():
+        copy_images(utils_args(folders=[ws.images[0].parent], output=ws.scratch("copy"), images=[".jpg"], uuid=False,
+                               manifest=None, no_manifest=True, mappings=None, copy_engine="fast",
+                               workers=ws.workers))
+    return run, len(ws.images), functools.partial(ws.reset, "copy")
+
+
+def case_threshold_and_crop(ws: Workspace):
+    from qolhelpers.images import threshold_and_crop
+    return lambda: [threshold_and_crop(path) for path in ws.images], len(ws.images)
+
+
+def case_crop_images(ws: Workspace):
+    from qolhelpers.utils import crop_images
+
+    def run():
+        crop_images(utils_args(folders=[ws.images[0].parent], output=ws.scratch("crop"), images=[".jpg"], padding=0,
+                               workers=ws.workers, pipeline=False, readers=2, writers=2, queue_size=64,
+                               boxes_only=None, scale=1, lossless=False))
+    return run, len(ws.images), functools.partial(ws.reset, "crop")
+
+
+def case_extract_features(ws: Workspace):
+    from qolhelpers.images import load_images_and_extract_features
+    return lambda: load_images_and_extract_features(ws.images, processes=ws.workers), len(ws.images)
+
+
+def case_detect_anomalies(ws: Workspace):
+    from qolhelpers.images import detect_anomalies
+    batch_size = max(1, len(ws.images) // 4)
+    return lambda: detect_anomalies(ws.images, n_clusters=4, batch_size=batch_size, processes=ws.workers), \
+        len(ws.images)
+
+
+def case_parse_coord_strings(ws: Workspace):
+    from qolhelpers.geo import parse_coord_strings
+    return lambda: parse_coord_strings(ws.dms_strings), len(ws.dms_strings)
+
+
+def case_latlong_conversion(ws: Workspace):
+    from qolhelpers.geo import LatLong
+    lats, lons = ws.decimal_degrees
+    return lambda: LatLong(lats, lons, vectorized=True).as_columns("dms"), len(lats)
+
+
+def case_convert_coords(ws: Workspace):
+    from qolhelpers.utils import convert_coords
+
+    def run():
+        convert_coords(utils_args(input=ws.coords_csv, output=ws.scratch("convert") / "out.csv", format="csv",
+                                  to="ddm", lat_column="latitude", lon_column="longitude", chunk_size=100_000,
+                                  workers=1))
+    return run, ws.scale["coords"], functools.partial(ws.reset, "convert")
+
+
+CASES = {name[len("case_"):]: func for name, func in globals().items() if name.startswith("case_")}
+
+
+def measure(func, repeats: int, reset=None) -> dict:
+    seconds = []
+    for _ in range(repeats):
+        if reset is not None:
+            reset()
+        start = time.perf_counter()
+        func()
+        seconds.append(time.perf_counter() - start)
+    if reset is not None:
+        reset()
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"seconds": min(seconds), "peak_bytes": peak}
+
+
+def run_suite(args) -> dict:
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        ws = Workspace(Path(tmp), SCALES[args.scale], args.workers)
+        for name in args.cases:
+            # Generate the inputs before timing.
+            func, items, *reset = CASES[name](ws)
+            result = measure(func, args.repeats, *reset)
+            result["items"] = items
+            result["items_per_second"] = items / result["seconds"] if result["seconds"] > 0 else 0.0
+            results[name] = result
+            print(f"{name:24s} {result['seconds']:9.3f} s {result['items_per_second']:14,.1f} items/s "
+                  f"{result['peak_bytes'] / 1e6:10.1f} MB peak", flush=True)
+    return {"meta": {"scale": args.scale, "workers": args.workers, "repeats": args.repeats,
+                     "python": platform.python_version(), "platform": platform.platform(),
+                     "cpu_count": os.cpu_count(), "numpy": np.__version__},
+            "results": results}
+
+
+def compare(current: dict, baseline: dict, tolerance: float) -> list:
+    """
+    List the regressions of current against baseline: throughput lower, or peak memory higher, by over tolerance.
+    """
+    if current["meta"]["scale"] != baseline["meta"]["scale"]:
+        print(f"Warning: comparing scale {current['meta']['scale']} against a {baseline['meta']['scale']} baseline.",
+              file=sys.stderr)
+    regressions = []
+    print(f"\n{'case':24s} {'throughput':>12s} {'peak memory':>12s}")
+    for name, result in current["results"].items():
+        reference = baseline["results"].get(name)
+        if reference is None:
+            print(f"{name:24s} {'(not in baseline)':>25s}")
+            continue
+        speed = result["items_per_second"] / reference["items_per_second"] if reference["items_per_second"] else 1.0
+        memory = result["peak_bytes"] / reference["peak_bytes"] if reference["peak_bytes"] else 1.0
+        flags = []
+        if speed < 1 - tolerance:
+            flags.append("SLOWER")
+        if memory > 1 + tolerance and result["peak_bytes"] - reference["peak_bytes"] > MEMORY_SLACK_BYTES:
+            flags.append("MORE MEMORY")
+        print(f"{name:24s} {speed:11.2f}x {memory:11.2f}x {' '.join(flags)}")
+        if flags:
+            regressions.append((name, flags))
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", choices=list(SCALES), default="small", help="Size of the synthetic datasets.")
+    parser.add_argument("--cases", nargs="+", choices=list(CASES), default=list(CASES), help="Cases to run.")
+    parser.add_argument("--repeats", type=int, default=3, help="Timed runs per case, the fastest is reported.")
+    parser.add_argument("--workers", type=int, default=2,
+                        help="Workers for the threaded and multiprocess cases. Fixed so results compare across hosts.")
+    parser.add_argument("--output", type=Path, default=None, help="Write the results JSON here.")
+    parser.add_argument("--save_baseline", type=Path, default=None, help="Store the results as the baseline.")
+    parser.add_argument("--baseline", type=Path, default=None, help="Baseline JSON to check for regressions.")
+    parser.add_argument("--tolerance", type=float, default=0.15,
+                        help="Relative slowdown or memory growth tolerated before a case is flagged.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    results = run_suite(args)
+    for path in (args.output, args.save_baseline):
+        if path is not None:
+            path.parent.mkdir(exist_ok=True, parents=True)
+            with open(path, "w") as f:
+                json.dump(results, f, indent=1)
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s): " + ", ".join(name for name, _ in regressions))
+            sys.exit(1)
@@ -1,13 +1,285 @@
-from typing import Union, Iterable
+from typing import Union, Iterable, Optional, Tuple, Generator
 
 import re
+import numpy as np
+
+
+# Structured dtypes returned by the vectorized (NumPy-backed) conversions.
+DD_DTYPE = np.dtype([("latitude", np.float64), ("longitude", np.float64)])
+_DDM_FIELDS = np.dtype([("deg", np.int64), ("min", np.float64)])
+DDM_DTYPE = np.dtype([("latitude", _DDM_FIELDS), ("longitude", _DDM_FIELDS)])
+_DMS_FIELDS = np.dtype([("deg", np.int64), ("min", np.int64), ("sec", np.float64)])
+DMS_DTYPE = np.dtype([("latitude", _DMS_FIELDS), ("longitude", _DMS_FIELDS)])
+
+# Mean Earth radius in metres, used for the spherical (haversine) distances.
+EARTH_RADIUS = 6371008.8
+# WGS84 ellipsoid, used for the ellipsoidal (Vincenty) distances.
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+
+# Coordinate string formats, compiled once and tried in this order.
+COORD_FORMATS = ("dd", "ddm", "dms")
+_COORD_PATTERNS = {
+    "dd": re.compile(r"^(?P<deg>-?\d+\.\d+)$"),
+    "ddm": re.compile(r"^(?P<deg>-?\d+)°?\s*(?P<min>\d+\.\d+)'?$"),
+    "dms": re.compile(r"^(?P<deg>-?\d+)°?\s*(?P<min>\d+)'?\s*(?P<sec>\d+\.\d+)\"?$"),
+}
+
+# Row patterns used to scan a whole column at once. _COLUMN_PATTERNS validates every row in a single C-level match so
+# the numbers can be handed straight to NumPy, _ROW_PATTERNS yields exactly one match per line when some rows are bad.
+# Fields must be separated by a symbol or whitespace, so "12.5" is not read as 1° 2.5' and every row of a column
+# matching a format holds that format's number of fields.
+_ROW_FORMATS = {
+    "dd": r"[ \t\r]*(-?\d+\.\d+)()()[ \t\r]*",
+    "ddm": r"[ \t\r]*(-?\d+)(?:°[ \t]*|[ \t]+)(\d+\.\d+)'?()[ \t\r]*",
+    "dms": r"[ \t\r]*(-?\d+)(?:°[ \t]*|[ \t]+)(\d+)(?:'[ \t]*|[ \t]+)(\d+\.\d+)\"?[ \t\r]*",
+}
+_COLUMN_PATTERNS = {fmt: re.compile(r"(?:{0}\n)*{0}".format(re.sub(r"\((?!\?)", "(?:", row)))
+                    for fmt, row in _ROW_FORMATS.items()}
+_ROW_PATTERNS = {fmt: re.compile(rf"^{row}$|^(.*)$", re.MULTILINE) for fmt, row in _ROW_FORMATS.items()}
+_FIELD_COUNTS = {"dd": 1, "ddm": 2, "dms": 3}
+
+
+def _as_text(coords) -> str:
+    if isinstance(coords, (bytes, bytearray, memoryview)):
+        text = bytes(coords).decode("utf-8")
+        # A trailing newline terminates the last row rather than starting an empty one.
+        return text[:-1] if text.endswith("\n") else text
+    if isinstance(coords, np.ndarray):
+        if coords.dtype.kind == "S":
+            coords = np.char.decode(coords, "utf-8")
+        coords = coords.ravel().tolist()
+    return "\n".join(coords)
+
+
+def guess_coord_format(coord_str: str) -> Optional[str]:
+    """
+    Guess the format of a coordinate string.
+    :param coord_str: A coordinate string, e.g. "51° 28' 38.20\"".
+    :return: One of COORD_FORMATS, or None if the string matches no known format.
+    """
+    coord_str = coord_str.strip()
+    for fmt in COORD_FORMATS:
+        if _COORD_PATTERNS[fmt].match(coord_str):
+            return fmt
+    return None
+
+
+def parse_coord_strings(coords: Union[Iterable[str], np.ndarray, bytes], fmt: Optional[str] = None
+                        ) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Bulk parse a column of coordinate strings into decimal degrees.
+    The format is guessed once from the first non-empty row (unless given) and the whole column is scanned in one
+    pass with that precompiled pattern. Rows in another format fall back to the remaining patterns.
+    :param coords: A sequence of strings, a NumPy string array (str or bytes dtype) or a newline separated bytes buffer.
+    :param fmt: Optional format of the column, one of COORD_FORMATS.
+    :return: A float64 array of decimal degrees (NaN for bad rows) and an array with the indices of the bad rows.
+    """
+    if not isinstance(coords, (bytes, bytearray, memoryview, np.ndarray)):
+        coords = list(coords)
+    if len(coords) == 0:
+        return np.empty(0, dtype=np.float64), np.empty(0, dtype=np.intp)
+    text = _as_text(coords)
+    if fmt is None:
+        first = next((line for line in text.split("\n", 64) if line.strip()), "")
+        fmt = guess_coord_format(first) or COORD_FORMATS[0]
+    elif fmt not in COORD_FORMATS:
+        raise ValueError(f"Unknown coordinate format {fmt}, expected one of {COORD_FORMATS}.")
+    if _COLUMN_PATTERNS[fmt].fullmatch(text):
+        # Every row is well formed, so the separators can be blanked out and the numbers parsed by NumPy directly.
+        numbers = text
+        for symbol in "°'\"":
+            numbers = numbers.replace(symbol, " ")
+        fields = np.fromstring(numbers, sep=" ")
+        # The row boundaries are lost here, so only trust the numbers if every row gave the same count.
+        if fields.size == (text.count("\n") + 1) * _FIELD_COUNTS[fmt]:
+            fields = fields.reshape(-1, _FIELD_COUNTS[fmt])
+            deg = fields[:, 0]
+            offset = sum(fields[:, i] / 60 ** i for i in range(1, fields.shape[1]))
+            return deg + np.where(np.signbit(deg), -1.0, 1.0) * offset, np.empty(0, dtype=np.intp)
+    groups = np.array(_ROW_PATTERNS[fmt].findall(text), dtype=np.str_).reshape(-1, 4)
+    good = groups[:, 0] != ""
+    deg = np.where(good, groups[:, 0], "nan").astype(np.float64)
+    min_ = np.where(groups[:, 1] != "", groups[:, 1], "0").astype(np.float64)
+    sec = np.where(groups[:, 2] != "", groups[:, 2], "0").astype(np.float64)
+    # "-0" is parsed to -0.0, so the sign bit carries the hemisphere even for zero degrees.
+    values = deg + np.where(np.signbit(deg), -1.0, 1.0) * (min_ / 60 + sec / 3600)
+    bad = []
+    for i in np.flatnonzero(~good):
+        row = groups[i, 3].strip()
+        match = next((m for m in (_COORD_PATTERNS[other].match(row) for other in COORD_FORMATS if other != fmt) if m),
+                     None)
+        if match is None:
+            bad.append(i)
+            continue
+        row_groups = match.groupdict()
+        row_deg = float(row_groups["deg"])
+        offset = float(row_groups.get("min", 0)) / 60 + float(row_groups.get("sec", 0)) / 3600
+        values[i] = row_deg - offset if "-" in row_groups["deg"] else row_deg + offset
+    return values, np.asarray(bad, dtype=np.intp)
+
+
+def _float_or_nan(value: str) -> float:
+    try:
+        return float(value)
+    except ValueError:
+        return float("nan")
+
+
+def parse_nmea_coords(values: Union[Iterable[str], np.ndarray], hemispheres: Union[Iterable[str], np.ndarray]
+                      ) -> np.ndarray:
+    """
+    Convert NMEA 0183 coordinate fields (e.g. "5128.6367" with hemisphere "N") into decimal degrees.
+    :param values: The (d)ddmm.mmmm fields. Empty or garbled fields become NaN.
+    :param hemispheres: The matching N/S/E/W fields.
+    :return: A float64 array of decimal degrees.
+    """
+    values = np.asarray(values, dtype=np.str_)
+    values = np.where(values == "", "nan", values)
+    try:
+        values = values.astype(np.float64)
+    except ValueError:
+        # Some field is garbled, convert one by one so only its own row is lost.
+        values = np.array([_float_or_nan(value) for value in values.tolist()], dtype=np.float64)
+    deg = np.trunc(values / 100)
+    dd = deg + (values - deg * 100) / 60
+    return np.where(np.isin(np.asarray(hemispheres, dtype=np.str_), ("S", "W")), -dd, dd)
+
+
+def haversine_distance(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """
+    Great-circle distance in metres between points given in decimal degrees. Inputs broadcast against each other.
+    """
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(x, dtype=np.float64)) for x in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def vincenty_distance(lat1, lon1, lat2, lon2, max_iter: int = 200, tol: float = 1e-12) -> np.ndarray:
+    """
+    Distance in metres on the WGS84 ellipsoid between points given in decimal degrees, using Vincenty's inverse
+    formula. Inputs broadcast against each other. All points are iterated together; points that do not converge
+    (nearly antipodal) are NaN.
+    """
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(x, dtype=np.float64)) for x in (lat1, lon1, lat2, lon2))
+    b = (1 - WGS84_F) * WGS84_A
+    big_l = lon2 - lon1
+    u1, u2 = np.arctan((1 - WGS84_F) * np.tan(lat1)), np.arctan((1 - WGS84_F) * np.tan(lat2))
+    sin_u1, cos_u1, sin_u2, cos_u2 = np.sin(u1), np.cos(u1), np.sin(u2), np.cos(u2)
+    lam = big_l
+    converged = np.zeros(np.broadcast(lat1, lon1, lat2, lon2).shape, dtype=bool)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for _ in range(max_iter):
+            sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+            sin_sigma = np.hypot(cos_u2 * sin_lam, cos_u1 * sin_u2 - sin_u1 * cos_u2 * cos_lam)
+            cos_sigma = sin_u1 * sin_u2 + cos_u1 * cos_u2 * cos_lam
+            sigma = np.arctan2(sin_sigma, cos_sigma)
+            sin_alpha = np.where(sin_sigma == 0, 0.0, cos_u1 * cos_u2 * sin_lam / sin_sigma)
+            cos2_alpha = 1 - sin_alpha ** 2
+            # Equatorial lines have cos2_alpha == 0.
+            cos_2sigma_m = np.where(cos2_alpha == 0, 0.0, cos_sigma - 2 * sin_u1 * sin_u2 / cos2_alpha)
+            c = WGS84_F / 16 * cos2_alpha * (4 + WGS84_F * (4 - 3 * cos2_alpha))
+            lam_prev = lam
+            lam = big_l + (1 - c) * WGS84_F * sin_alpha * (
+                sigma + c * sin_sigma * (cos_2sigma_m + c * cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)))
+            converged = np.abs(lam - lam_prev) <= tol
+            if converged.all():
+                break
+        u_sq = cos2_alpha * (WGS84_A ** 2 - b ** 2) / b ** 2
+        big_a = 1 + u_sq / 16384 * (4096 + u_sq * (-768 + u_sq * (320 - 175 * u_sq)))
+        big_b = u_sq / 1024 * (256 + u_sq * (-128 + u_sq * (74 - 47 * u_sq)))
+        delta_sigma = big_b * sin_sigma * (cos_2sigma_m + big_b / 4 * (
+            cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)
+            - big_b / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2sigma_m ** 2)))
+        distance = b * big_a * (sigma - delta_sigma)
+    return np.where(converged, distance, np.nan)
+
+
+def initial_bearing(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """
+    Initial great-circle bearing in degrees [0, 360) from the first to the second point, given in decimal degrees.
+    Inputs broadcast against each other.
+    """
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(x, dtype=np.float64)) for x in (lat1, lon1, lat2, lon2))
+    d_lon = lon2 - lon1
+    theta = np.arctan2(np.sin(d_lon) * np.cos(lat2),
+                       np.cos(lat1) * np.sin(lat2) - np.sin(lat1) * np.cos(lat2) * np.cos(d_lon))
+    return np.degrees(theta) % 360
+
+
+DISTANCE_METHODS = {"haversine": haversine_distance, "vincenty": vincenty_distance}
+
+
+def _distance_method(method: str):
+    if method not in DISTANCE_METHODS:
+        raise ValueError(f"Unknown distance method {method}, expected one of {tuple(DISTANCE_METHODS)}.")
+    return DISTANCE_METHODS[method]
+
+
+def iter_pairwise_distances(a: "LatLong", b: Optional["LatLong"] = None, chunk_size: int = 1024,
+                            method: str = "haversine") -> Generator[Tuple[slice, np.ndarray], None, None]:
+    """
+    All-pairs distances in row blocks, so at most chunk_size x len(b) distances are held in memory at once.
+    :param a: Rows of the distance matrix.
+    :param b: Columns of the distance matrix, defaults to a.
+    :param chunk_size: Number of rows per block.
+    :param method: One of DISTANCE_METHODS.
+    :return: A generator of (row slice, block of distances in metres).
+    """
+    distance = _distance_method(method)
+    b = a if b is None else b
+    lat_a, lon_a = np.atleast_1d(a.latitude), np.atleast_1d(a.longitude)
+    lat_b, lon_b = np.atleast_1d(b.latitude)[None], np.atleast_1d(b.longitude)[None]
+    for start in range(0, len(lat_a), chunk_size):
+        rows = slice(start, min(start + chunk_size, len(lat_a)))
+        yield rows, distance(lat_a[rows, None], lon_a[rows, None], lat_b, lon_b)
 
 
 class LatLong:
     def __init__(self, latitude: Union[float, int, str, Iterable[Union[float, int, str]]],
-                 longitude: Union[float, int, str, Iterable[Union[float, int, str]]]):
-        self.latitude = self._parse_coords(latitude)
-        self.longitude = self._parse_coords(longitude)
+                 longitude: Union[float, int, str, Iterable[Union[float, int, str]]],
+                 vectorized: bool = False):
+        """
+        :param latitude: A single latitude or a batch of latitudes (decimal degrees, or DDM/DMS strings).
+        :param longitude: A single longitude or a batch of longitudes (decimal degrees, or DDM/DMS strings).
+        :param vectorized: Store batches as contiguous float64 arrays and return structured arrays from the
+            conversion methods instead of tuples. Intended for large batches.
+        """
+        self.vectorized = vectorized
+        if vectorized:
+            self.latitude = self._parse_array(latitude)
+            self.longitude = self._parse_array(longitude)
+            if self.latitude.shape != self.longitude.shape:
+                raise ValueError("Latitude and longitude must have the same shape.")
+        else:
+            self.latitude = self._parse_coords(latitude)
+            self.longitude = self._parse_coords(longitude)
+
+    def __len__(self):
+        if isinstance(self.latitude, (float, int)):
+            return 1
+        return len(self.latitude)
+
+    def _parse_array(self, coords):
+        if isinstance(coords, (float, int, str)):
+            coords = [coords]
+        if isinstance(coords, (bytes, bytearray, memoryview)) or \
+                (isinstance(coords, np.ndarray) and coords.dtype.kind in "US"):
+            return self._parse_str_array(coords)
+        if not isinstance(coords, np.ndarray) or coords.dtype.kind == "O":
+            coords = list(np.ravel(coords)) if isinstance(coords, np.ndarray) else list(coords)
+            if any(isinstance(coord, str) for coord in coords):
+                if all(isinstance(coord, str) for coord in coords):
+                    return self._parse_str_array(coords)
+                coords = [self._parse_coord(coord) for coord in coords]
+        return np.ascontiguousarray(coords, dtype=np.float64).ravel()
+
+    @staticmethod
+    def _parse_str_array(coords):
+        values, bad = parse_coord_strings(coords)
+        if len(bad):
+            raise ValueError(f"Invalid coordinate string format in {len(bad)} rows, first at index {bad[0]}.")
+        return values
 
     def _parse_coord(self, coord):
         if isinstance(coord, (float, int)):
@@ -26,14 +298,8 @@ class LatLong:
             raise ValueError("Invalid input type for latitude or longitude.")
 
     def _parse_coord_str(self, coord_str):
-        patterns = [
-            r"^(?P<deg>-?\d+\.\d+)$",
-            r"^(?P<deg>-?\d+)°?\s*(?P<min>\d+\.\d+)'?$",
-            r"^(?P<deg>-?\d+)°?\s*(?P<min>\d+)'?\s*(?P<sec>\d+\.\d+)\"?$",
-        ]
-
-        for pattern in patterns:
-            match = re.match(pattern, coord_str.strip())
+        for fmt in COORD_FORMATS:
+            match = _COORD_PATTERNS[fmt].match(coord_str.strip())
             if match:
                 groups = match.groupdict()
                 deg = float(groups.get("deg", 0))
@@ -43,12 +309,103 @@ class LatLong:
 
         raise ValueError("Invalid coordinate string format.")
 
+    def distance_to(self, other: "LatLong", method: str = "haversine") -> np.ndarray:
+        """
+        Element-wise distances in metres to another LatLong of the same length, or one-to-many if either has a
+        single point.
+        :param other: The other coordinates.
+        :param method: One of DISTANCE_METHODS.
+        """
+        return _distance_method(method)(np.asarray(self.latitude), np.asarray(self.longitude),
+                                        np.asarray(other.latitude), np.asarray(other.longitude))
+
+    def bearing_to(self, other: "LatLong") -> np.ndarray:
+        """
+        Element-wise (or one-to-many) initial bearings in degrees to another LatLong.
+        """
+        return initial_bearing(np.asarray(self.latitude), np.asarray(self.longitude),
+                               np.asarray(other.latitude), np.asarray(other.longitude))
+
+    def consecutive_distances(self, method: str = "haversine") -> np.ndarray:
+        """
+        Distances in metres between consecutive points of a track, of length len(self) - 1.
+        """
+        lat, lon = np.atleast_1d(self.latitude), np.atleast_1d(self.longitude)
+        return _distance_method(method)(lat[:-1], lon[:-1], lat[1:], lon[1:])
+
+    def consecutive_bearings(self) -> np.ndarray:
+        """
+        Initial bearings in degrees between consecutive points of a track, of length len(self) - 1.
+        """
+        lat, lon = np.atleast_1d(self.latitude), np.atleast_1d(self.longitude)
+        return initial_bearing(lat[:-1], lon[:-1], lat[1:], lon[1:])
+
+    def track_length(self, method: str = "haversine", cumulative: bool = False) -> Union[float, np.ndarray]:
+        """
+        Length of the track through the points in order, in metres.
+        :param method: One of DISTANCE_METHODS.
+        :param cumulative: Return the distance along the track at every point (starting at 0) instead of the total.
+        """
+        distances = self.consecutive_distances(method)
+        if cumulative:
+            return np.concatenate([[0.0], np.cumsum(distances)])
+        return float(distances.sum())
+
+    def pairwise_distances(self, other: Optional["LatLong"] = None, method: str = "haversine",
+                           chunk_size: int = 1024, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        All-pairs distance matrix in metres, computed in row blocks (see iter_pairwise_distances).
+        :param other: Columns of the matrix, defaults to self.
+        :param method: One of DISTANCE_METHODS.
+        :param chunk_size: Number of rows computed at once.
+        :param out: Optional (len(self), len(other)) array to fill, e.g. a np.memmap for matrices larger than memory.
+        """
+        other = self if other is None else other
+        if out is None:
+            out = np.empty((len(self), len(other)), dtype=np.float64)
+        for rows, block in iter_pairwise_distances(self, other, chunk_size, method):
+            out[rows] = block
+        return out
+
+    def as_columns(self, representation: str = "dd") -> dict:
+        """
+        Flatten a conversion into named 1D arrays, e.g. for writing columns to a CSV file.
+        :param representation: "dd", "ddm" or "dms".
+        :return: A dict of column name to array, e.g. {"latitude_deg": ..., "latitude_min": ..., ...}. In the "dd"
+            representation the "_deg" columns hold decimal degrees.
+        """
+        latlong = self if self.vectorized else LatLong(np.atleast_1d(self.latitude), np.atleast_1d(self.longitude),
+                                                       vectorized=True)
+        if representation == "dd":
+            coords = latlong.as_decimal_degrees()
+            return {f"{name}_deg": coords[name] for name in coords.dtype.names}
+        elif representation == "ddm":
+            coords = latlong.as_degrees_decimal_minutes()
+        elif representation == "dms":
+            coords = latlong.as_degrees_minutes_seconds()
+        else:
+            raise ValueError(f"Unknown representation {representation}, expected one of {COORD_FORMATS}.")
+        return {f"{name}_{part}": coords[name][part] for name in coords.dtype.names for part in coords[name].dtype.names}
+
     def as_decimal_degrees(self):
+        if self.vectorized:
+            coords = np.empty(len(self.latitude), dtype=DD_DTYPE)
+            coords["latitude"] = self.latitude
+            coords["longitude"] = self.longitude
+            return coords
         if isinstance(self.latitude, (float, int)):
             return self.latitude, self.longitude
         return tuple([*zip(self.latitude, self.longitude)])
 
     def as_degrees_decimal_minutes(self):
+        if self.vectorized:
+            coords = np.empty(len(self.latitude), dtype=DDM_DTYPE)
+            for field, values in (("latitude", self.latitude), ("longitude", self.longitude)):
+                deg = np.trunc(values)
+                coords[field]["deg"] = deg
+                # The minutes carry the sign of the coordinate, same as the scalar conversion.
+                coords[field]["min"] = (values - deg) * 60
+            return coords
         if isinstance(self.latitude, (float, int)):
             lat_deg = -int(abs(self.latitude)) if self.latitude < 0 else int(abs(self.latitude))
             lat_min = abs(self.latitude) % 1 * -60 if self.latitude < 0 else abs(self.latitude) % 1 * 60
@@ -63,6 +420,16 @@ class LatLong:
             return tuple([((lat_d, lat_m), (lon_d, lon_m)) for lat_d, lat_m, lon_d, lon_m in zip(lat_deg, lat_min, lon_deg, lon_min)])
 
     def as_degrees_minutes_seconds(self):
+        if self.vectorized:
+            coords = np.empty(len(self.latitude), dtype=DMS_DTYPE)
+            for field, values in (("latitude", self.latitude), ("longitude", self.longitude)):
+                deg = np.trunc(values)
+                minutes = (values - deg) * 60
+                min_int = np.trunc(minutes)
+                coords[field]["deg"] = deg
+                coords[field]["min"] = min_int
+                coords[field]["sec"] = (minutes - min_int) * 60
+            return coords
         if isinstance(self.latitude, (float, int)):
             (lat_deg, lat_min), (lon_deg, lon_min) = self.as_degrees_decimal_minutes()
             lat_min_int = -int(abs(lat_min)) if self.latitude < 0 else int(abs(lat_min))
@@ -81,10 +448,65 @@ class LatLong:
                 dms_coords.append(((lat_deg, lat_min_int, lat_sec), (lon_deg, lon_min_int, lon_sec)))
             return tuple(dms_coords)
 
+
+def _as_radians(latlong: LatLong) -> np.ndarray:
+    return np.radians(np.column_stack([np.atleast_1d(latlong.latitude), np.atleast_1d(latlong.longitude)]))
+
+
+class LatLongIndex:
+    def __init__(self, latlong: LatLong, leaf_size: int = 40):
+        """
+        Haversine ball tree over a batch of coordinates for nearest-neighbour and within-radius lookups.
+        Queries are O(log n) per point instead of a brute-force scan. Distances are in metres on a sphere of radius
+        EARTH_RADIUS.
+        :param latlong: The coordinates to index, preferably a vectorized LatLong.
+        :param leaf_size: Number of points at which the tree switches to brute force, see sklearn.neighbors.BallTree.
+        """
+        # scikit-learn is only needed once an index is built.
+        from sklearn.neighbors import BallTree
+        self._tree = BallTree(_as_radians(latlong), leaf_size=leaf_size, metric="haversine")
+
+    def __len__(self):
+        return self._tree.data.shape[0]
+
+    def query(self, latlong: LatLong, k: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find the k nearest indexed points to every query point.
+        :param latlong: The query coordinates.
+        :param k: Number of neighbours to return per query point.
+        :return: Distances in metres and indices into the indexed batch, both of shape (n_queries, k) and sorted by
+            distance.
+        """
+        distances, indices = self._tree.query(_as_radians(latlong), k=k)
+        return distances * EARTH_RADIUS, indices
+
+    def query_radius(self, latlong: LatLong, radius: float, return_distance: bool = False, sort_results: bool = False):
+        """
+        Find all indexed points within a radius of every query point.
+        :param latlong: The query coordinates.
+        :param radius: Search radius in metres.
+        :param return_distance: Also return the distances in metres.
+        :param sort_results: Sort the neighbours of each query point by distance (requires return_distance).
+        :return: An object array with one index array per query point, and the matching distances if requested.
+        """
+        result = self._tree.query_radius(_as_radians(latlong), r=radius / EARTH_RADIUS,
+                                         return_distance=return_distance, sort_results=sort_results)
+        if return_distance:
+            indices, distances = result
+            for d in distances:
+                d *= EARTH_RADIUS
+            return indices, distances
+        return result
+
 """
 # Example usage:
 latlong = LatLong("51° 28' 38.20\"", "-0° 0' 5.31\"")
 print(latlong.as_decimal_degrees()) # (51.477277777777774, -0.001475)
 print(latlong.as_degrees_decimal_minutes()) # ((51, 28.636666666666663), (-0, 0.08833333333333336))
 print(latlong.as_degrees_minutes_seconds()) # ((51, 28, 38.200000000000045), (-0, 0, 5.310000000000002))
+
+# Vectorized usage for large batches:
+latlong = LatLong(np.array([51.477277777777774, -12.3456789]), np.array([-0.001475, 0.123456789]), vectorized=True)
+dms = latlong.as_degrees_minutes_seconds()
+print(dms["latitude"]["deg"], dms["latitude"]["sec"]) # [ 51 -12] [ 38.2 -44.44404]
 """
@@ -1,30 +1,517 @@
 from pathlib import Path
 import cv2
+import hashlib
+import json
+import os
+import time
+import itertools
+import math
+import functools
+import shutil
+import subprocess
+import sys
 import numpy as np
-from skimage.feature import hog
-from sklearn.preprocessing import StandardScaler
-from sklearn.cluster import KMeans
-from sklearn.metrics import pairwise_distances
-from typing import List, Generator, Union
-from multiprocessing import Pool, cpu_count
+from PIL import Image
+from typing import List, Generator, Union, Optional, Sequence, Iterable, Tuple, TYPE_CHECKING
+from multiprocessing import Pool, cpu_count, shared_memory, resource_tracker
+from qolhelpers import metrics
+from qolhelpers.metrics import Measured
+
+# scikit-image and scikit-learn take over a second to import, so they are only imported by the functions using them.
+if TYPE_CHECKING:
+    from sklearn.preprocessing import StandardScaler
+    from sklearn.cluster import MiniBatchKMeans
+
+
+# Size images are resized to and the HOG parameters used by extract_features.
+FEATURE_SIZE = (128, 128)
+HOG_PARAMS = dict(orientations=8, pixels_per_cell=(16, 16), cells_per_block=(1, 1))
+# Images each worker decodes and stacks into one hog_batch call.
+FEATURE_CHUNK_SIZE = 64
+# Decode images at reduced resolution when they are large enough, see read_grayscale.
+REDUCED_DECODE = True
+
+# Scale factors OpenCV can decode at directly. For JPEG the reduction happens in the DCT, so the skipped pixels are
+# never decoded.
+_REDUCED_GRAYSCALE_FLAGS = {8: cv2.IMREAD_REDUCED_GRAYSCALE_8, 4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+                            2: cv2.IMREAD_REDUCED_GRAYSCALE_2}
+
+
+def reduced_decode_factor(image_size: Tuple[int, int], min_size: Tuple[int, int]) -> int:
+    """
+    The largest of 8, 4 or 2 that an image can be scaled down by and still be at least min_size, otherwise 1.
+    :param image_size: (width, height) of the image.
+    :param min_size: (width, height) the decoded image must not be smaller than.
+    """
+    for factor in _REDUCED_GRAYSCALE_FLAGS:
+        if image_size[0] // factor >= min_size[0] and image_size[1] // factor >= min_size[1]:
+            return factor
+    return 1
+
+
+def read_grayscale(image_file: Union[Path, str], min_size: Optional[Tuple[int, int]] = None) -> Optional[np.ndarray]:
+    """
+    Read an image as grayscale, decoding at 1/2, 1/4 or 1/8 scale when the result is still at least min_size.
+    :param image_file: The image to read.
+    :param min_size: (width, height) the image is going to be resized to. None decodes at full resolution.
+    :return: The grayscale image, or None if it could not be read (same as cv2.imread).
+    """
+    factor = 1
+    if min_size is not None:
+        try:
+            # Only the header is read here.
+            with Image.open(image_file) as img:
+                factor = reduced_decode_factor(img.size, min_size)
+        except (OSError, ValueError):
+            pass
+    return cv2.imread(str(image_file), _REDUCED_GRAYSCALE_FLAGS.get(factor, cv2.IMREAD_GRAYSCALE))
 
 
 def extract_features(image_file: Path):
-    img = cv2.imread(str(image_file), cv2.IMREAD_GRAYSCALE)
-    img = cv2.resize(img, (128, 128))
-    fd = hog(img, orientations=8, pixels_per_cell=(16, 16), cells_per_block=(1, 1))
+    """
+    :return: The image path and its HOG features, or None for the features if the image could not be read.
+    """
+    from skimage.feature import hog
+    img = _read_feature_image(image_file)
+    if img is None:
+        print(f"Could not read {image_file}, skipping it.", file=sys.stderr)
+        return image_file, None
+    fd = hog(img, **HOG_PARAMS)
     return image_file, fd
 
 
-def load_images_and_extract_features(image_directory: Union[List[Path], Generator[Path, None, None]]):
-    with Pool(processes=cpu_count() - 1) as pool:
-        results = pool.map(extract_features, image_directory)
-    image_directory, features = zip(*results)
-    return list(image_directory), features
+def _orientation_bins(g_row: np.ndarray, g_col: np.ndarray, orientations: int) -> np.ndarray:
+    # Hard assignment to [i * width, (i + 1) * width) degree bins like skimage, corrected for rounding in the division.
+    orientation = np.rad2deg(np.arctan2(g_row, g_col)) % 180
+    width = 180. / orientations
+    bins = np.floor(orientation / width).astype(np.intp)
+    bins -= orientation < bins * width
+    bins += orientation >= (bins + 1) * width
+    return np.clip(bins, 0, orientations - 1, out=bins)
+
+
+@functools.lru_cache(maxsize=4)
+def _uint8_gradient_tables(orientations: int) -> Tuple[np.ndarray, np.ndarray]:
+    # Gradients of uint8 images are integers in [-255, 255], so magnitudes and bins can be looked up per pair.
+    g_row, g_col = np.meshgrid(np.arange(-255, 256, dtype=np.float64), np.arange(-255, 256, dtype=np.float64),
+                               indexing="ij")
+    return np.hypot(g_col, g_row).ravel(), _orientation_bins(g_row, g_col, orientations).ravel()
+
+
+def hog_batch(images: np.ndarray, orientations: int = 8, pixels_per_cell: Tuple[int, int] = (16, 16),
+              cells_per_block: Tuple[int, int] = (1, 1)) -> np.ndarray:
+    """
+    Vectorized HOG over a stack of grayscale images, matching skimage.feature.hog with the default L2-Hys block
+    normalization, but computing the gradients, histograms and normalization for the whole batch at once.
+    :param images: Array of shape (n_images, rows, columns). uint8 stacks use lookup tables for the gradients.
+    :return: Array of shape (n_images, n_features), one skimage feature vector per row.
+    """
+    images = np.asarray(images)
+    n, s_row, s_col = images.shape
+    c_row, c_col = pixels_per_cell
+    b_row, b_col = cells_per_block
+    n_cells_row, n_cells_col = s_row // c_row, s_col // c_col
+    if n_cells_row < b_row or n_cells_col < b_col:
+        raise ValueError(f"Images should have at least {b_row * c_row} rows and {b_col * c_col} cols.")
+    # Central differences with zero borders, as in skimage.
+    dtype = np.int32 if images.dtype == np.uint8 else np.float64
+    pixels = images.astype(dtype)
+    g_row = np.zeros_like(pixels)
+    g_col = np.zeros_like(pixels)
+    np.subtract(pixels[:, 2:, :], pixels[:, :-2, :], out=g_row[:, 1:-1, :])
+    np.subtract(pixels[:, :, 2:], pixels[:, :, :-2], out=g_col[:, :, 1:-1])
+    rows, cols = n_cells_row * c_row, n_cells_col * c_col
+    g_row, g_col = g_row[:, :rows, :cols], g_col[:, :rows, :cols]
+    if images.dtype == np.uint8:
+        magnitudes, orientation_bins = _uint8_gradient_tables(orientations)
+        pair = (g_row + 255) * 511 + (g_col + 255)
+        magnitude, bins = magnitudes[pair], orientation_bins[pair]
+    else:
+        magnitude, bins = np.hypot(g_col, g_row), _orientation_bins(g_row, g_col, orientations)
+    cell_index = (np.arange(rows) // c_row)[:, None] * n_cells_col + (np.arange(cols) // c_col)[None, :]
+    index = (np.arange(n)[:, None, None] * (n_cells_row * n_cells_col) + cell_index) * orientations + bins
+    histogram = np.bincount(index.ravel(), weights=magnitude.ravel(), minlength=n * n_cells_row * n_cells_col *
+                            orientations).reshape(n, n_cells_row, n_cells_col, orientations) / (c_row * c_col)
+    # Overlapping blocks of cells, normalized with L2-Hys.
+    blocks = np.lib.stride_tricks.sliding_window_view(histogram, (b_row, b_col), axis=(1, 2))
+    blocks = blocks.transpose(0, 1, 2, 4, 5, 3).reshape(n, -1, b_row * b_col * orientations)
+    eps = 1e-5
+    blocks = blocks / np.sqrt(np.sum(blocks ** 2, axis=-1, keepdims=True) + eps ** 2)
+    blocks = np.minimum(blocks, 0.2)
+    blocks = blocks / np.sqrt(np.sum(blocks ** 2, axis=-1, keepdims=True) + eps ** 2)
+    return blocks.reshape(n, -1)
+
+
+def _read_feature_image(image_file: Path) -> Optional[np.ndarray]:
+    img = read_grayscale(image_file, FEATURE_SIZE if REDUCED_DECODE else None)
+    return cv2.resize(img, FEATURE_SIZE) if img is not None else None
+
+
+@functools.lru_cache(maxsize=None)
+def _n_features() -> int:
+    return hog_batch(np.zeros((1, *FEATURE_SIZE[::-1])), **HOG_PARAMS).shape[1]
+
+
+def extract_features_batch(image_files: Sequence[Path]) -> Tuple[List[Path], np.ndarray]:
+    """
+    Batched counterpart of extract_features: decode and resize all images, then run hog_batch on the stack.
+    Images that cannot be read are reported on stderr and left out.
+    :return: The paths of the readable images and an array of shape (len(paths), n_features).
+    """
+    paths, images = [], []
+    for image_file in image_files:
+        img = _read_feature_image(image_file)
+        if img is None:
+            print(f"Could not read {image_file}, skipping it.", file=sys.stderr)
+            continue
+        paths.append(image_file)
+        images.append(img)
+    if not images:
+        return paths, np.empty((0, _n_features()))
+    return paths, hog_batch(np.stack(images), **HOG_PARAMS)
+
+
+def _extract_features_to_shared_memory(task: Tuple[Sequence[Path], str, Tuple[int, int], int]) -> Tuple[int, List[int]]:
+    image_files, name, shape, offset = task
+    paths, features = extract_features_batch(image_files)
+    readable = set(map(str, paths))
+    rows = [offset + i for i, image_file in enumerate(image_files) if str(image_file) in readable]
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        out = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+        out[rows] = features
+        del out
+    finally:
+        shm.close()
+    return len(image_files), sorted(set(range(offset, offset + len(image_files))) - set(rows))
+
+
+def _feature_pool(processes: Optional[int] = None) -> Pool:
+    # Forked workers share the parent's resource tracker only if it runs before they start. Otherwise each worker
+    # starts its own, which reports the shared memory it attached to as leaked once the parent unlinks it.
+    resource_tracker.ensure_running()
+    return Pool(processes=processes or max(1, cpu_count() - 1))
+
+
+def _submit_features(pool, image_files: List[Path], chunk_size: int = FEATURE_CHUNK_SIZE):
+    """
+    Start extracting features for image_files in the pool, chunk_size images per hog_batch call. Workers write their
+    rows straight into one shared memory array, so only paths and the rows of unreadable images are pickled.
+    :return: A handle for _gather_features.
+    """
+    shape = (len(image_files), _n_features())
+    shm = shared_memory.SharedMemory(create=True, size=max(1, shape[0] * shape[1] * 8))
+    tasks = [(image_files[i:i + chunk_size], shm.name, shape, i) for i in range(0, len(image_files), chunk_size)]
+    return image_files, shm, shape, pool.map_async(Measured(_extract_features_to_shared_memory), tasks)
+
+
+def _gather_features(submitted) -> List[Tuple[Path, Optional[np.ndarray]]]:
+    """
+    Wait for a _submit_features call and free its shared memory.
+    :return: (image path, features or None if it could not be read) for every image submitted, in order.
+    """
+    image_files, shm, shape, result = submitted
+    try:
+        chunks = metrics.collect("extract_features", result.get(), items=lambda chunk: chunk[0])
+        unreadable = {row for _, rows in chunks for row in rows}
+        features = np.ndarray(shape, dtype=np.float64, buffer=shm.buf).copy()
+    finally:
+        shm.close()
+        shm.unlink()
+    return [(image_file, None if i in unreadable else features[i]) for i, image_file in enumerate(image_files)]
+
+
+def _discard_features(submitted):
+    # Free the shared memory of a submission that will not be gathered, once its workers are done with it.
+    _, shm, _, result = submitted
+    try:
+        result.wait()
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def load_images_and_extract_features_batched(image_files: Sequence[Path], batch_size: int = FEATURE_CHUNK_SIZE,
+                                             processes: Optional[int] = None) -> Tuple[List[Path], np.ndarray]:
+    """
+    Extract features with extract_features_batch in a process pool, see _submit_features.
+    :param image_files: Images to extract features from.
+    :param batch_size: Number of images each worker stacks into one hog_batch call.
+    :param processes: Number of worker processes, defaults to one less than the number of CPUs.
+    :return: The paths of the readable images and an array of shape (len(paths), n_features).
+    """
+    image_files = list(image_files)
+    with _feature_pool(processes) as pool:
+        results = _gather_features(_submit_features(pool, image_files, batch_size))
+    return _drop_unreadable(image_files, [fd for _, fd in results])
+
+
+class FeatureCache:
+    def __init__(self, directory: os.PathLike, max_bytes: Optional[int] = None):
+        """
+        Persistent cache of extract_features results. Entries are keyed on the resolved path, mtime, size and the HOG
+        parameters, so new or changed files miss and everything else is read back from a memory-mapped array.
+        :param directory: Folder holding features.f8 (the raw float64 rows) and index.json.
+        :param max_bytes: Evict least recently used entries on save() once the features exceed this size.
+        """
+        self.directory = Path(directory)
+        self.directory.mkdir(exist_ok=True, parents=True)
+        self.max_bytes = max_bytes
+        self._features_path = self.directory / "features.f8"
+        self._index_path = self.directory / "index.json"
+        self._params = json.dumps({"size": FEATURE_SIZE, "hog": HOG_PARAMS, "reduced_decode": REDUCED_DECODE},
+                                  sort_keys=True)
+        self._dim = None
+        # key -> [row, last used timestamp, path]
+        self._entries = {}
+        self._keys_by_path = {}
+        self._rows = 0
+        self._memmap = None
+        if self._index_path.exists():
+            with open(self._index_path, "r") as f:
+                index = json.load(f)
+            if index.get("params") == self._params:
+                self._dim, self._rows, self._entries = index["dim"], index["rows"], index["entries"]
+                self._keys_by_path = {path: key for key, (_, _, path) in self._entries.items()}
+            else:
+                # The feature parameters changed, none of the stored features are valid any more.
+                self.invalidate()
+        # Rows put after the last save() belong to no entry, e.g. after the process was killed. Drop them so the file
+        # and the index agree on where the next row goes.
+        row_bytes = (self._dim or 0) * np.dtype(np.float64).itemsize
+        if self._features_path.exists() and self._features_path.stat().st_size > self._rows * row_bytes:
+            os.truncate(self._features_path, self._rows * row_bytes)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, image_file: os.PathLike):
+        return self._key(image_file) in self._entries
+
+    def _key(self, image_file: os.PathLike) -> str:
+        path = str(Path(image_file).resolve())
+        stat = os.stat(path)
+        return hashlib.sha1(f"{path}|{stat.st_mtime_ns}|{stat.st_size}|{self._params}".encode()).hexdigest()
+
+    def _features(self) -> np.ndarray:
+        if self._memmap is None or self._memmap.shape[0] != self._rows:
+            self._memmap = np.memmap(self._features_path, dtype=np.float64, mode="r", shape=(self._rows, self._dim))
+        return self._memmap
+
+    def get(self, image_file: os.PathLike) -> Optional[np.ndarray]:
+        """
+        :return: The cached features of image_file, or None if it is new or has changed.
+        """
+        entry = self._entries.get(self._key(image_file))
+        if entry is None:
+            return None
+        entry[1] = time.time()
+        return np.array(self._features()[entry[0]])
+
+    def put(self, image_file: os.PathLike, features: np.ndarray):
+        features = np.ascontiguousarray(features, dtype=np.float64).ravel()
+        if self._dim is None:
+            self._dim = features.size
+        elif features.size != self._dim:
+            raise ValueError(f"Expected {self._dim} features, got {features.size}.")
+        key, path = self._key(image_file), str(Path(image_file).resolve())
+        if key in self._entries:
+            return
+        # Drop the entry for an older version of the same file.
+        self._entries.pop(self._keys_by_path.get(path), None)
+        # Write at the row's own offset rather than appending, so the row number recorded always matches the data.
+        fd = os.open(self._features_path, os.O_WRONLY | os.O_CREAT, 0o644)
+        try:
+            os.pwrite(fd, features.tobytes(), self._rows * features.nbytes)
+        finally:
+            os.close(fd)
+        self._entries[key] = [self._rows, time.time(), path]
+        self._keys_by_path[path] = key
+        self._rows += 1
+
+    def invalidate(self, image_files: Optional[Sequence[os.PathLike]] = None):
+        """
+        Remove the given files from the cache, or everything if image_files is None.
+        """
+        if image_files is None:
+            self._entries, self._keys_by_path, self._rows, self._dim, self._memmap = {}, {}, 0, None, None
+            self._features_path.unlink(missing_ok=True)
+        else:
+            for image_file in image_files:
+                self._entries.pop(self._keys_by_path.pop(str(Path(image_file).resolve()), None), None)
+            self._compact()
+        self.save()
+
+    def _compact(self):
+        if len(self._entries) == self._rows:
+            return
+        entries = sorted(self._entries.values(), key=lambda entry: entry[0])
+        features = self._features()
+        tmp_path = self._features_path.with_suffix(".tmp")
+        with open(tmp_path, "wb") as f:
+            for row, entry in enumerate(entries):
+                f.write(features[entry[0]].tobytes())
+                entry[0] = row
+        self._memmap = None
+        os.replace(tmp_path, self._features_path)
+        self._rows = len(entries)
+
+    def evict(self):
+        """
+        Drop least recently used entries until the features fit in max_bytes.
+        """
+        if self.max_bytes is None or self._dim is None:
+            return
+        max_rows = self.max_bytes // (self._dim * np.dtype(np.float64).itemsize)
+        if len(self._entries) > max_rows:
+            by_age = sorted(self._entries, key=lambda key: self._entries[key][1])
+            for key in by_age[:len(self._entries) - max_rows]:
+                self._keys_by_path.pop(self._entries.pop(key)[2], None)
+        self._compact()
+
+    def save(self):
+        """
+        Evict if needed and write the index to disk.
+        """
+        self.evict()
+        tmp_path = self._index_path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"params": self._params, "dim": self._dim, "rows": self._rows, "entries": self._entries}, f)
+        os.replace(tmp_path, self._index_path)
+
+
+def _lookup_features(image_files: List[Path], cache: Optional[FeatureCache]):
+    features = [cache.get(image_file) for image_file in image_files] if cache is not None else [None] * len(image_files)
+    return features, [image_files[i] for i, fd in enumerate(features) if fd is None]
+
+
+def _merge_features(features: list, results, cache: Optional[FeatureCache]):
+    missing = [i for i, fd in enumerate(features) if fd is None]
+    for i, (image_file, fd) in zip(missing, results):
+        features[i] = fd
+        # Unreadable images are not cached, they are tried again on the next run.
+        if cache is not None and fd is not None:
+            cache.put(image_file, fd)
+    return features
 
 
-def detect_anomalies(image_directory, n_clusters=10, threshold=2.5):
-    image_files, features = load_images_and_extract_features(image_directory)
+def _drop_unreadable(image_files: List[Path], features: list) -> Tuple[List[Path], np.ndarray]:
+    readable = [i for i, fd in enumerate(features) if fd is not None]
+    if not readable:
+        return [], np.empty((0, _n_features()))
+    return [image_files[i] for i in readable], np.stack([features[i] for i in readable])
+
+
+def load_images_and_extract_features(image_directory: Union[List[Path], Generator[Path, None, None]],
+                                     cache: Optional[FeatureCache] = None, processes: Optional[int] = None):
+    image_directory = list(image_directory)
+    features, missing = _lookup_features(image_directory, cache)
+    if missing:
+        with _feature_pool(processes) as pool:
+            _merge_features(features, _gather_features(_submit_features(pool, missing)), cache)
+    if cache is not None:
+        cache.save()
+    readable = [i for i, fd in enumerate(features) if fd is not None]
+    return [image_directory[i] for i in readable], tuple(features[i] for i in readable)
+
+
+def iter_feature_batches(image_files: Iterable[Path], batch_size: int = 1024, processes: Optional[int] = None,
+                         cache: Optional[FeatureCache] = None) -> Generator[Tuple[List[Path], np.ndarray], None, None]:
+    """
+    Stream HOG features in batches. The next batch is extracted in the pool while the current one is consumed, so at
+    most two batches of features are held in memory however many images there are.
+    :param image_files: Images to extract features from, consumed lazily.
+    :param batch_size: Number of images per batch.
+    :param processes: Number of worker processes, defaults to one less than the number of CPUs.
+    :param cache: Optional FeatureCache to read features from and store new features in.
+    :return: A generator of (image paths, features array of shape (len(image paths), n_features)), one per batch_size
+        input images. Images that cannot be read are reported on stderr and left out of their batch.
+    """
+    image_files = iter(image_files)
+    with _feature_pool(processes) as pool:
+        def submit_next():
+            batch = list(itertools.islice(image_files, batch_size))
+            if not batch:
+                return None
+            features, missing = _lookup_features(batch, cache)
+            return batch, features, _submit_features(pool, missing) if missing else None
+
+        pending = None
+        try:
+            pending = submit_next()
+            while pending is not None:
+                batch, features, submitted = pending
+                pending = None
+                try:
+                    pending = submit_next()
+                finally:
+                    results = _gather_features(submitted) if submitted is not None else []
+                # Unreadable images are dropped from the batch, which may leave it empty.
+                yield _drop_unreadable(batch, _merge_features(features, results, cache))
+        finally:
+            # Closed early: free the shared memory of the batch extracted ahead.
+            if pending is not None and pending[2] is not None:
+                _discard_features(pending[2])
+            if cache is not None:
+                cache.save()
+
+
+def fit_anomaly_model(image_files: Iterable[Path], n_clusters: int = 10, batch_size: int = 1024,
+                      processes: Optional[int] = None, cache: Optional[FeatureCache] = None):
+    """
+    Incrementally fit the feature scaler and a MiniBatchKMeans clustering from streamed feature batches.
+    Each batch is standardized with the scaler statistics seen so far before it updates the clusters.
+    :return: The fitted StandardScaler and MiniBatchKMeans.
+    """
+    scaler, kmeans = new_anomaly_model(n_clusters)
+    for _, features in iter_feature_batches(image_files, batch_size, processes, cache):
+        update_anomaly_model(scaler, kmeans, features)
+    return scaler, kmeans
+
+
+def new_anomaly_model(n_clusters: int = 10):
+    from sklearn.preprocessing import StandardScaler
+    from sklearn.cluster import MiniBatchKMeans
+    return StandardScaler(), MiniBatchKMeans(n_clusters=n_clusters, random_state=42, n_init=3)
+
+
+def update_anomaly_model(scaler: "StandardScaler", kmeans: "MiniBatchKMeans", features: np.ndarray):
+    if len(features) == 0:
+        return
+    scaler.partial_fit(features)
+    kmeans.partial_fit(scaler.transform(features))
+
+
+def iter_anomaly_scores(image_files: Iterable[Path], scaler: "StandardScaler", kmeans: "MiniBatchKMeans",
+                        batch_size: int = 1024, processes: Optional[int] = None, cache: Optional[FeatureCache] = None
+                        ) -> Generator[Tuple[List[Path], np.ndarray], None, None]:
+    """
+    Stream the distance of every image to its nearest cluster centroid, larger is more anomalous.
+    :return: A generator of (image paths, distances).
+    """
+    for image_files, features in iter_feature_batches(image_files, batch_size, processes, cache):
+        if len(features) == 0:
+            yield image_files, np.empty(0)
+            continue
+        standardized_features = scaler.transform(features)
+        labels = kmeans.predict(standardized_features)
+        yield image_files, np.linalg.norm(standardized_features - kmeans.cluster_centers_[labels], axis=1)
+
+
+def detect_anomalies(image_directory, n_clusters=10, threshold=2.5, cache: Optional[FeatureCache] = None,
+                     batch_size: Optional[int] = None, processes: Optional[int] = None):
+    if batch_size is not None:
+        # Out-of-core mode: one streaming pass to fit, a second one to score. Peak memory depends on batch_size only.
+        image_files = list(image_directory)
+        scaler, kmeans = fit_anomaly_model(image_files, n_clusters, batch_size, processes, cache)
+        return [image_file for batch, distances in iter_anomaly_scores(image_files, scaler, kmeans, batch_size,
+                                                                       processes, cache)
+                for image_file, distance in zip(batch, distances) if distance > threshold]
+
+    from sklearn.preprocessing import StandardScaler
+    from sklearn.cluster import KMeans
+    from sklearn.metrics import pairwise_distances
+    image_files, features = load_images_and_extract_features(image_directory, cache, processes)
 
     # Standardize features
     scaler = StandardScaler()
@@ -45,31 +532,105 @@ def detect_anomalies(image_directory, n_clusters=10, threshold=2.5):
     return outlier_images
 
 
-def threshold_and_crop(image, padding=0):
-    if isinstance(image, (Path, str)):
-        image = cv2.imread(str(image))
-    # Grayscale
-    gray = image.copy()
-    if image.ndim > 2:
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-
+def _threshold_box(gray: np.ndarray, kernel_size: int = 5) -> Tuple[int, int, int, int]:
     # Threshold the image to create a binary image
     ret, thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
 
-    kernel = cv2.getStructuringElement(cv2.MORPH_RECT,(5,5))
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (kernel_size, kernel_size))
     thresh = cv2.morphologyEx(thresh, cv2.MORPH_OPEN, kernel)
 
-    x, y, w, h = cv2.boundingRect(thresh)
+    return cv2.boundingRect(thresh)
 
-    # Add padding to the bounding rectangle
+
+def _pad_box(box: Tuple[int, int, int, int], shape: Tuple[int, ...], padding: int) -> Tuple[int, int, int, int]:
+    x, y, w, h = box
     x = max(0, x - padding)
     y = max(0, y - padding)
-    w = min(image.shape[1] - x, w + 2 * padding)
-    h = min(image.shape[0] - y, h + 2 * padding)
+    w = min(shape[1] - x, w + 2 * padding)
+    h = min(shape[0] - y, h + 2 * padding)
+    return x, y, w, h
 
-    cropped_image = image[y:y+h, x:x+w, ...]
 
-    return cropped_image
+def _scale_box(box: Tuple[int, int, int, int], reduced_shape: Tuple[int, ...], shape: Tuple[int, ...], scale: int
+               ) -> Tuple[int, int, int, int]:
+    # The reduced image is 1/scale of the full one rounded up (JPEG, whose reduced pixels cover aligned scale x scale
+    # blocks) or down (PNG, resized by area). Map each edge with both the nominal scale and the real size ratio and keep
+    # the outermost, so the box never loses content, then clamp it to the image.
+    x, y, w, h = box
+    if scale > 1:
+        # An edge pixel only partly covered by content can fall below the threshold, so widen by one reduced pixel.
+        x, y, w, h = x - 1, y - 1, w + 2, h + 2
+    ratio_y, ratio_x = shape[0] / reduced_shape[0], shape[1] / reduced_shape[1]
+    x0 = max(0, math.floor(min(x * scale, x * ratio_x)))
+    y0 = max(0, math.floor(min(y * scale, y * ratio_y)))
+    x1 = min(shape[1], math.ceil(max((x + w) * scale, (x + w) * ratio_x)))
+    y1 = min(shape[0], math.ceil(max((y + h) * scale, (y + h) * ratio_y)))
+    return x0, y0, x1 - x0, y1 - y0
+
+
+def find_crop_box(image: Union[np.ndarray, Path, str], padding: int = 0, scale: int = 1) -> Tuple[int, int, int, int]:
+    """
+    Find the threshold_and_crop bounding box without cropping. With scale > 1 the Otsu threshold and morphology run
+    on a 1/scale copy of the image (decoded at reduced resolution for files) and the box is mapped back to full
+    resolution rounding outward, so each side may be up to about 2 * scale pixels further out than the full resolution
+    box, but not further in.
+    :param image: An image array or the path to an image.
+    :param padding: Padding in full resolution pixels.
+    :param scale: One of 1, 2, 4 or 8.
+    :return: (x, y, width, height) in full resolution pixels. For files, in the stored pixel order with any EXIF
+        orientation ignored, which is what jpegtran crops.
+    """
+    if scale not in (1, *_REDUCED_GRAYSCALE_FLAGS):
+        raise ValueError(f"Scale must be one of 1, 2, 4 or 8, got {scale}.")
+    if isinstance(image, (Path, str)):
+        gray = cv2.imread(str(image), _REDUCED_GRAYSCALE_FLAGS.get(scale, cv2.IMREAD_GRAYSCALE) |
+                          cv2.IMREAD_IGNORE_ORIENTATION)
+        if gray is None:
+            raise ValueError(f"Could not read {image}.")
+        try:
+            # The header holds the stored size, which like IMREAD_IGNORE_ORIENTATION ignores EXIF orientation.
+            with Image.open(image) as img:
+                shape = img.size[::-1]
+        except OSError:
+            # A format OpenCV reads but PIL does not, assume the reduced decode rounded down.
+            shape = gray.shape[0] * scale, gray.shape[1] * scale
+    else:
+        shape = image.shape
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim > 2 else image
+        if scale > 1:
+            gray = cv2.resize(gray, (-(-shape[1] // scale), -(-shape[0] // scale)), interpolation=cv2.INTER_AREA)
+    # Scale the 5x5 opening kernel down with the image, keeping it odd so the opening does not shift the box.
+    box = _threshold_box(gray, max(1, 5 // scale) | 1)
+    return _pad_box(_scale_box(box, gray.shape, shape, scale), shape, padding)
+
+
+def lossless_jpeg_crop(image_file: Union[Path, str], output_file: Union[Path, str], box: Tuple[int, int, int, int]):
+    """
+    Crop a JPEG without decoding and re-encoding it, using jpegtran (libjpeg-turbo). jpegtran moves the top left
+    corner up and left to the nearest iMCU boundary (8 or 16 pixels), so the output can be slightly larger than box.
+    :param image_file: JPEG to crop.
+    :param output_file: Where to write the cropped JPEG.
+    :param box: (x, y, width, height) to crop.
+    """
+    jpegtran = shutil.which("jpegtran")
+    if jpegtran is None:
+        raise FileNotFoundError("Lossless JPEG cropping requires jpegtran (libjpeg-turbo) on the PATH.")
+    x, y, w, h = box
+    subprocess.run([jpegtran, "-crop", f"{w}x{h}+{x}+{y}", "-copy", "all", "-outfile", str(output_file),
+                    str(image_file)], check=True, capture_output=True)
+
 
+def threshold_and_crop(image, padding=0):
+    if isinstance(image, (Path, str)):
+        image = cv2.imread(str(image))
+    # Grayscale
+    gray = image.copy()
+    if image.ndim > 2:
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
 
+    # Add padding to the bounding rectangle
+    x, y, w, h = _pad_box(_threshold_box(gray), image.shape, padding)
 
+    cropped_image = image[y:y+h, x:x+w, ...]
+
+    return cropped_image
@@ -0,0 +1,310 @@
+import json
+import os
+import sys
+import threading
+import time
+import collections
+import contextlib
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Union
+
+# Metrics of the current run, None when metrics are off so that record and observe cost a single check.
+_active: Optional["Metrics"] = None
+
+METRICS_FORMATS = ("json", "prometheus")
+PROFILERS = ("cprofile", "sample")
+
+
+class StageStats:
+    def __init__(self, name: str, workers: int = 1):
+        """
+        Item count, busy time and bytes moved by one stage, summed over its workers. Busy time is also kept per worker
+        so a stage with one stalled worker can be told apart from an evenly loaded one.
+        """
+        self.name = name
+        self.workers = workers
+        self.items = 0
+        self.busy = 0.0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.worker_busy = collections.defaultdict(float)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float, items: int = 1, bytes_read: int = 0, bytes_written: int = 0,
+               worker: Optional[str] = None):
+        worker = worker or threading.current_thread().name
+        with self._lock:
+            self.items += items
+            self.busy += seconds
+            self.bytes_read += bytes_read
+            self.bytes_written += bytes_written
+            self.worker_busy[worker] += seconds
+
+    def summary(self, wall_time: float) -> str:
+        rate = self.items / wall_time if wall_time > 0 else 0.0
+        utilization = self.busy / (wall_time * self.workers) if wall_time > 0 else 0.0
+        return f"{self.name:8s} {self.items:8d} items {rate:10.1f} items/s {utilization:6.1%} busy ({self.workers} workers)"
+
+    def as_dict(self, wall_time: float) -> dict:
+        # The worker count is the number of workers configured or seen, whichever is larger.
+        workers = max(self.workers, len(self.worker_busy))
+        return {"workers": workers, "items": self.items, "busy_seconds": self.busy,
+                "items_per_second": self.items / wall_time if wall_time > 0 else 0.0,
+                "utilization": self.busy / (wall_time * workers) if wall_time > 0 else 0.0,
+                "bytes_read": self.bytes_read, "bytes_written": self.bytes_written,
+                "worker_utilization": {worker: busy / wall_time if wall_time > 0 else 0.0
+                                       for worker, busy in sorted(self.worker_busy.items())}}
+
+
+class Gauge:
+    def __init__(self, name: str):
+        """
+        Samples of a level such as a queue depth, summarised as their count, mean, maximum and last value.
+        """
+        self.name = name
+        self.samples = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            self.samples += 1
+            self.total += value
+            self.max = max(self.max, value)
+            self.last = value
+
+    def as_dict(self) -> dict:
+        return {"samples": self.samples, "mean": self.total / self.samples if self.samples else 0.0, "max": self.max,
+                "last": self.last}
+
+
+class Metrics:
+    def __init__(self):
+        """
+        Registry of the stages and gauges of one run.
+        """
+        self.start = time.perf_counter()
+        self.stages: Dict[str, StageStats] = {}
+        self.gauges: Dict[str, Gauge] = {}
+        self._lock = threading.Lock()
+
+    def stage(self, name: str, workers: int = 1) -> StageStats:
+        with self._lock:
+            if name not in self.stages:
+                self.stages[name] = StageStats(name, workers)
+            return self.stages[name]
+
+    def add_stage(self, stage: StageStats):
+        """
+        Report a StageStats kept by the caller, e.g. the stages of crop_pipeline.
+        """
+        with self._lock:
+            self.stages[stage.name] = stage
+
+    def gauge(self, name: str) -> Gauge:
+        with self._lock:
+            if name not in self.gauges:
+                self.gauges[name] = Gauge(name)
+            return self.gauges[name]
+
+    def as_dict(self) -> dict:
+        wall_time = time.perf_counter() - self.start
+        return {"wall_seconds": wall_time,
+                "stages": {name: stage.as_dict(wall_time) for name, stage in self.stages.items()},
+                "gauges": {name: gauge.as_dict() for name, gauge in self.gauges.items()}}
+
+    def to_json(self) -> str:
+        return json.dumps(self.as_dict(), indent=1)
+
+    def to_prometheus(self) -> str:
+        """
+        The metrics in the Prometheus text exposition format, e.g. for the node_exporter textfile collector.
+        """
+        summary = self.as_dict()
+        lines = ["# TYPE qolhelpers_wall_seconds gauge", f"qolhelpers_wall_seconds {summary['wall_seconds']}"]
+        stage_metrics = [("items_total", "items", "counter"), ("busy_seconds_total", "busy_seconds", "counter"),
+                         ("bytes_read_total", "bytes_read", "counter"),
+                         ("bytes_written_total", "bytes_written", "counter"),
+                         ("utilization", "utilization", "gauge"), ("workers", "workers", "gauge")]
+        for metric, key, kind in stage_metrics:
+            lines.append(f"# TYPE qolhelpers_stage_{metric} {kind}")
+            lines.extend(f'qolhelpers_stage_{metric}{{stage="{name}"}} {stage[key]}'
+                         for name, stage in summary["stages"].items())
+        lines.append("# TYPE qolhelpers_worker_utilization gauge")
+        lines.extend(f'qolhelpers_worker_utilization{{stage="{name}",worker="{worker}"}} {utilization}'
+                     for name, stage in summary["stages"].items()
+                     for worker, utilization in stage["worker_utilization"].items())
+        for key in ("mean", "max", "last"):
+            lines.append(f"# TYPE qolhelpers_gauge_{key} gauge")
+            lines.extend(f'qolhelpers_gauge_{key}{{name="{name}"}} {gauge[key]}'
+                         for name, gauge in summary["gauges"].items())
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: Union[Path, str], fmt: str = "json"):
+        if fmt not in METRICS_FORMATS:
+            raise ValueError(f"Unknown metrics format {fmt}, expected one of {METRICS_FORMATS}.")
+        Path(path).parent.mkdir(exist_ok=True, parents=True)
+        with open(path, "w") as f:
+            f.write(self.to_json() if fmt == "json" else self.to_prometheus())
+
+
+def enable() -> Metrics:
+    """
+    Start collecting metrics for the current run, replacing any collected so far.
+    """
+    global _active
+    _active = Metrics()
+    return _active
+
+
+def disable() -> Optional[Metrics]:
+    global _active
+    metrics, _active = _active, None
+    return metrics
+
+
+def enabled() -> bool:
+    return _active is not None
+
+
+def active() -> Optional[Metrics]:
+    return _active
+
+
+def record(stage: str, seconds: float, items: int = 1, bytes_read: int = 0, bytes_written: int = 0,
+           worker: Optional[str] = None):
+    """
+    Add to a stage of the active run, does nothing when metrics are off.
+    """
+    if _active is not None:
+        _active.stage(stage).record(seconds, items, bytes_read, bytes_written, worker)
+
+
+def observe(gauge: str, value: float):
+    """
+    Sample a gauge of the active run, does nothing when metrics are off.
+    """
+    if _active is not None:
+        _active.gauge(gauge).observe(value)
+
+
+def add_stage(stage: StageStats):
+    if _active is not None:
+        _active.add_stage(stage)
+
+
+class Measured:
+    def __init__(self, func):
+        """
+        Picklable wrapper timing a function inside pool worker processes, where the parent's metrics are not
+        reachable. Calls return (result, seconds, worker), pass the results through collect in the parent.
+        """
+        self.func = func
+
+    def __call__(self, *args, **kwargs):
+        start = time.perf_counter()
+        result = self.func(*args, **kwargs)
+        return result, time.perf_counter() - start, f"pid-{os.getpid()}"
+
+
+def collect(stage: str, results: Iterable[tuple], items=None) -> List:
+    """
+    Record the timings of Measured results under stage and return the bare results.
+    :param items: Optional callable giving the number of items a result covers, e.g. for batched calls. Default 1.
+    """
+    values = []
+    for result, seconds, worker in results:
+        record(stage, seconds, items=items(result) if items is not None else 1, worker=worker)
+        values.append(result)
+    return values
+
+
+class Sampler:
+    def __init__(self, interval: float = 0.005):
+        """
+        Sampling profiler covering every thread of the process, unlike cProfile which only sees the thread that
+        enabled it. Stacks are counted in the collapsed format read by flamegraph.pl and speedscope.
+        """
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="metrics-sampler", daemon=True)
+
+    def _run(self):
+        own = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def write(self, path: Union[Path, str]):
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+@contextlib.contextmanager
+def profile(path: Union[Path, str], profiler: str = "cprofile"):
+    """
+    Profile the body and write the result to path: a pstats file for cprofile, collapsed stacks for sample.
+    """
+    if profiler not in PROFILERS:
+        raise ValueError(f"Unknown profiler {profiler}, expected one of {PROFILERS}.")
+    Path(path).parent.mkdir(exist_ok=True, parents=True)
+    if profiler == "cprofile":
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(str(path))
+    else:
+        sampler = Sampler()
+        sampler.start()
+        try:
+            yield
+        finally:
+            sampler.stop()
+            sampler.write(path)
+
+
+@contextlib.contextmanager
+def session(metrics_path: Optional[Path] = None, metrics_format: str = "json", profile_path: Optional[Path] = None,
+            profiler: str = "cprofile"):
+    """
+    Collect metrics and profile the body as requested. Outputs are written even if the body raises or is interrupted,
+    since a run that stalled is usually the one worth looking at.
+    """
+    with contextlib.ExitStack() as stack:
+        if profile_path is not None:
+            stack.enter_context(profile(profile_path, profiler))
+        if metrics_path is None:
+            yield None
+            return
+        metrics = enable()
+        try:
+            yield metrics
+        finally:
+            disable()
+            metrics.write(metrics_path, metrics_format)
@@ -3,41 +3,130 @@ import shutil
 import argparse
 import mimetypes
 import uuid
+import stat
 import json
-import tqdm
+import pickle
+import sqlite3
+import hashlib
+import csv
+import itertools
+import functools
+import collections
 import concurrent.futures
+import threading
+import queue
+import time
 from pathlib import Path
-from typing import Sequence, Tuple, List, Union
+from typing import Sequence, Tuple, List, Union, Set, Generator, Iterable, Optional, TYPE_CHECKING
 import sys
 import os
-from qolhelpers.images import threshold_and_crop, detect_anomalies
-import cv2
+from qolhelpers import metrics
+from qolhelpers.metrics import StageStats
 
+# OpenCV, NumPy, tqdm, asyncio and qolhelpers.images (which pulls in scikit-image and scikit-learn) are imported by the
+# subcommands that use them, so printing help or copying files does not pay for loading them.
+if TYPE_CHECKING:
+    import numpy as np
+    from qolhelpers.geo import LatLong
 
-def find_files_threaded(path: os.PathLike, extensions: Sequence[str], recursive: bool) -> List[Path]:
-    # Make the path of type pathlib.Path
-    if not isinstance(path, Path):
-        path = Path(path)
-    file_paths = []
+
+def scan_directory(path: os.PathLike, extensions: Set[str]) -> Tuple[List[Path], List[Path]]:
+    """
+    List one directory with a single os.scandir call.
+    :param path: The directory to list.
+    :param extensions: Set of suffixes (including the '.') to match.
+    :return: The matching files in inode order (roughly their order on disk) and the subdirectories.
+    """
+    start = time.perf_counter()
+    files, directories = [], []
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        directories.append(Path(entry.path))
+                    elif os.path.splitext(entry.name)[1] in extensions and entry.is_file():
+                        files.append((entry.inode(), entry.path))
+                except OSError:
+                    continue
+    except OSError as e:
+        print(f"Could not list {path}: {e}", file=sys.stderr)
+    metrics.record("find", time.perf_counter() - start, items=len(files))
+    return [Path(file) for _, file in sorted(files)], directories
+
+
+def _check_root(path: Path, extensions: Set[str]) -> Union[List[Path], None]:
+    # Returns the files to yield for a root that is not a directory, or None if it is one.
     if not path.exists():
         print(f"Could not find {path}.", file=sys.stderr)
-        return file_paths
-    # If the path is a directory, glob for the extensions
+        return []
     if path.is_dir():
-        for ext in extensions:
-            file_paths.extend(path.rglob(f"*{ext}")) if recursive else file_paths.extend(path.glob(f"*{ext}"))
+        return None
     # If it's a file, check that it has a matching extension.
-    elif path.is_file():
+    if path.is_file():
         if path.suffix not in extensions:
             print(f"Not one of the specified file types: {path}.", file=sys.stderr)
-            return file_paths
-        file_paths.append(path)
-    else:
-        print(f"Not a file or directory: {path}", file=sys.stderr)
+            return []
+        return [path]
+    print(f"Not a file or directory: {path}", file=sys.stderr)
+    return []
 
+
+def _normalise_extensions(extensions: Union[str, Sequence[str]]) -> Set[str]:
+    if isinstance(extensions, str):
+        extensions = [extensions]
+    return {ext if ext.startswith(".") else "." + ext for ext in extensions}
+
+
+def find_files_threaded(path: os.PathLike, extensions: Sequence[str], recursive: bool) -> List[Path]:
+    # Make the path of type pathlib.Path
+    if not isinstance(path, Path):
+        path = Path(path)
+    extensions = _normalise_extensions(extensions)
+    file_paths = _check_root(path, extensions)
+    if file_paths is not None:
+        return file_paths
+    # Walk the directory once, matching every entry against the set of extensions.
+    file_paths, directories = [], [path]
+    while directories:
+        files, subdirectories = scan_directory(directories.pop(), extensions)
+        file_paths.extend(files)
+        if recursive:
+            directories.extend(subdirectories)
     return file_paths
 
 
+def iter_files(extensions: Union[str, Sequence[str]], paths: Union[os.PathLike, Sequence[os.PathLike]],
+               recursive: bool = False, num_threads: int = 4) -> Generator[Path, None, None]:
+    """
+    Finds files with the specified extensions in the specified paths and yields them as they are found.
+    Every directory is listed once with os.scandir, and subdirectories are spread across the worker threads.
+    :param extensions: The extension of the file, starting with a '.' is optional (e.g. '.png')
+    :param paths:  A list of Path objects pointing to specific files, or directories to search.
+    :param recursive: Flag to indicate if the directory search should be recursive or not.
+    :param num_threads: Number of worker threads listing directories.
+    :return: A generator of Path objects, grouped by directory.
+    """
+    extensions = _normalise_extensions(extensions)
+    if isinstance(paths, (str, os.PathLike)):
+        paths = [paths]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, num_threads)) as executor:
+        pending = set()
+        for path in map(Path, paths):
+            file_paths = _check_root(path, extensions)
+            if file_paths is None:
+                pending.add(executor.submit(scan_directory, path, extensions))
+            else:
+                yield from file_paths
+        while pending:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for task in done:
+                files, directories = task.result()
+                if recursive:
+                    pending.update(executor.submit(scan_directory, directory, extensions) for directory in directories)
+                yield from files
+
+
 def find_files(extensions: Union[str, Sequence[str]], paths: Union[os.PathLike, Sequence[os.PathLike]],
                recursive: bool = False, num_threads: int = 4) -> Tuple[Path]:
     """
@@ -48,30 +137,199 @@ def find_files(extensions: Union[str, Sequence[str]], paths: Union[os.PathLike,
             :param num_threads: Number of worker threads to complete search.
             :return: A tuple of valid Path objects.
         """
-    extensions = [ext if ext.startswith(".") else "." + ext for ext in extensions]
+    return tuple(iter_files(extensions, paths, recursive, num_threads))
+
+
+class DirectoryIndex:
+    # Directory mtimes closer than this to the scan are not trusted, as a later change could share the same mtime.
+    MTIME_SLACK_NS = 2_000_000_000
+
+    def __init__(self, path: os.PathLike):
+        """
+        Persistent SQLite index of directory listings. A directory is only listed again when its mtime changes, so
+        repeated scans of a mostly unchanged archive cost one stat per directory. Every file is indexed whatever its
+        extension, so one index serves queries for any set of extensions.
+        :param path: SQLite database file, created if it does not exist.
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(exist_ok=True, parents=True)
+        self._db = sqlite3.connect(str(self.path))
+        self._db.executescript("""
+            PRAGMA journal_mode = WAL;
+            PRAGMA synchronous = NORMAL;
+            CREATE TABLE IF NOT EXISTS directories (
+                id INTEGER PRIMARY KEY, path TEXT UNIQUE NOT NULL, parent INTEGER, mtime_ns INTEGER);
+            CREATE INDEX IF NOT EXISTS directories_parent ON directories (parent);
+            CREATE TABLE IF NOT EXISTS files (
+                directory INTEGER NOT NULL, name TEXT NOT NULL, suffix TEXT NOT NULL, inode INTEGER,
+                PRIMARY KEY (directory, name));
+            CREATE INDEX IF NOT EXISTS files_suffix ON files (suffix, directory);
+            CREATE TEMP TABLE IF NOT EXISTS scanned (id INTEGER PRIMARY KEY);
+        """)
+        self.listed = 0
+        self.reused = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._db.close()
+
+    @staticmethod
+    def _list_directory(path: str, mtime_ns: Union[int, None]):
+        # Runs in a worker thread, so it only touches the file system.
+        try:
+            start = time.perf_counter()
+            current = os.stat(path).st_mtime_ns
+            if current == mtime_ns:
+                metrics.record("find", time.perf_counter() - start, items=0)
+                return current, None
+            files, directories = [], []
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            directories.append(entry.path)
+                        elif entry.is_file():
+                            files.append((entry.name, os.path.splitext(entry.name)[1], entry.inode()))
+                    except OSError:
+                        continue
+            metrics.record("find", time.perf_counter() - start, items=len(files))
+            return current, (files, directories)
+        except OSError as e:
+            print(f"Could not list {path}: {e}", file=sys.stderr)
+            return None, None
+
+    def _directory_id(self, path: str, parent: Union[int, None] = None) -> Tuple[int, Union[int, None]]:
+        self._db.execute("INSERT OR IGNORE INTO directories (path, parent) VALUES (?, ?)", (path, parent))
+        return self._db.execute("SELECT id, mtime_ns FROM directories WHERE path = ?", (path,)).fetchone()
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=num_threads) as executor:
-        tasks = [executor.submit(find_files_threaded, path, extensions, recursive) for path in paths]
-        file_paths = [result for task in concurrent.futures.as_completed(tasks) for result in task.result()]
+    def _remove_tree(self, directory_id: int):
+        tree = """WITH RECURSIVE tree(id) AS (
+                      SELECT ? UNION ALL SELECT directories.id FROM directories JOIN tree ON directories.parent = tree.id)
+                  """
+        self._db.execute(tree + "DELETE FROM files WHERE directory IN tree", (directory_id,))
+        self._db.execute(tree + "DELETE FROM directories WHERE id IN tree", (directory_id,))
 
-    return tuple(file_paths)
+    def _update(self, directory_id: int, mtime_ns: int, files: list, directories: List[str]):
+        self._db.execute("DELETE FROM files WHERE directory = ?", (directory_id,))
+        self._db.executemany("INSERT INTO files (directory, name, suffix, inode) VALUES (?, ?, ?, ?)",
+                             [(directory_id,) + file for file in files])
+        current = set(directories)
+        for child_id, child_path in self._db.execute("SELECT id, path FROM directories WHERE parent = ?",
+                                                     (directory_id,)).fetchall():
+            if child_path not in current:
+                self._remove_tree(child_id)
+        for child_path in directories:
+            self._directory_id(child_path, directory_id)
+        if mtime_ns > time.time_ns() - self.MTIME_SLACK_NS:
+            mtime_ns = None
+        self._db.execute("UPDATE directories SET mtime_ns = ? WHERE id = ?", (mtime_ns, directory_id))
+
+    def refresh(self, paths: Sequence[os.PathLike], recursive: bool = False, num_threads: int = 4) -> int:
+        """
+        Bring the index up to date for the given directories, listing only those whose mtime has changed, and mark
+        them as the directories searched by the following query.
+        :param paths: Directories to refresh.
+        :param recursive: Also refresh every subdirectory.
+        :param num_threads: Number of worker threads stat-ing and listing directories.
+        :return: Number of directories searched.
+        """
+        self._db.execute("DELETE FROM scanned")
+        frontier = [(path,) + tuple(self._directory_id(path)) for path in map(os.path.abspath, paths)]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, num_threads)) as executor:
+            while frontier:
+                listings = executor.map(lambda row: self._list_directory(row[0], row[2]), frontier)
+                next_frontier = []
+                for (path, directory_id, _), (mtime_ns, listing) in zip(frontier, listings):
+                    if mtime_ns is None:
+                        continue
+                    if listing is None:
+                        self.reused += 1
+                    else:
+                        self.listed += 1
+                        self._update(directory_id, mtime_ns, *listing)
+                    self._db.execute("INSERT OR IGNORE INTO scanned (id) VALUES (?)", (directory_id,))
+                    if recursive:
+                        next_frontier.extend(self._db.execute(
+                            "SELECT path, id, mtime_ns FROM directories WHERE parent = ?", (directory_id,)))
+                frontier = next_frontier
+        self._db.commit()
+        return self._db.execute("SELECT COUNT(*) FROM scanned").fetchone()[0]
+
+    def find(self, extensions: Union[str, Sequence[str]], paths: Union[os.PathLike, Sequence[os.PathLike]],
+             recursive: bool = False, num_threads: int = 4) -> Generator[Path, None, None]:
+        """
+        Finds files with the specified extensions like iter_files, answering from the index where directories are
+        unchanged. Paths are absolute and grouped by directory in inode order.
+        :param extensions: The extension of the file, starting with a '.' is optional (e.g. '.png')
+        :param paths:  A list of Path objects pointing to specific files, or directories to search.
+        :param recursive: Flag to indicate if the directory search should be recursive or not.
+        :param num_threads: Number of worker threads refreshing the index.
+        :return: A generator of Path objects.
+        """
+        extensions = _normalise_extensions(extensions)
+        if isinstance(paths, (str, os.PathLike)):
+            paths = [paths]
+        directories = []
+        for path in map(Path, paths):
+            file_paths = _check_root(path, extensions)
+            if file_paths is None:
+                directories.append(path)
+            else:
+                yield from (file.absolute() for file in file_paths)
+        if not directories:
+            return
+        self.refresh(directories, recursive, num_threads)
+        query = f"""SELECT directories.path, files.name FROM scanned
+                    JOIN directories ON directories.id = scanned.id
+                    JOIN files ON files.directory = scanned.id
+                    WHERE files.suffix IN ({", ".join("?" * len(extensions))})
+                    ORDER BY directories.path, files.inode"""
+        parent, parent_path = None, None
+        for directory, name in self._db.execute(query, tuple(extensions)):
+            # Rows come grouped by directory, joining onto a parsed parent is about twice as fast as parsing each path.
+            if directory != parent:
+                parent, parent_path = directory, Path(directory)
+            yield parent_path / name
+
+
+def discover_files(args: argparse.Namespace) -> Iterable[Path]:
+    """
+    Finds the files for a subcommand, through the directory index when --index is given.
+    """
+    if getattr(args, "index", None) is None:
+        yield from iter_files(args.images, args.folders, args.recursive, args.workers)
+        return
+    with DirectoryIndex(args.index) as index:
+        yield from index.find(args.images, args.folders, args.recursive, args.workers)
 
 
-def get_extensions_for_type(general_type):
+@functools.lru_cache(maxsize=None)
+def get_extensions_for_type(general_type) -> Tuple[str]:
     """
-    A tool to list all the possible extensions for a given file type.
+    A tool to list all the possible extensions for a given file type. The mimetype database is only read once.
     :param general_type:
     :return:
     """
     mimetypes.init()
-    for ext in mimetypes.types_map:
-        if mimetypes.types_map[ext].split('/')[0] == general_type:
-            yield ext
+    return tuple(ext for ext in mimetypes.types_map if mimetypes.types_map[ext].split('/')[0] == general_type)
 
 
 def parse_args():
     parent_parser = argparse.ArgumentParser()
     parent_parser.add_argument("-v", "--verbose", action="store_true", help="Print information.")
+    parent_parser.add_argument("--metrics", type=Path, default=None,
+                               help="Write per-stage timings, bytes, queue depths and worker utilization to this file.")
+    parent_parser.add_argument("--metrics_format", choices=metrics.METRICS_FORMATS, default="json",
+                               help="Format of the --metrics file, JSON or Prometheus text.")
+    parent_parser.add_argument("--profile", type=Path, default=None, help="Profile the run and write it to this file.")
+    parent_parser.add_argument("--profiler", choices=metrics.PROFILERS, default="cprofile",
+                               help="cprofile writes pstats of the main thread, sample writes collapsed stacks of all "
+                                    "threads.")
     subparsers = parent_parser.add_subparsers(dest="command")
     copy_images = subparsers.add_parser("copy_images",
                                         add_help=True,
@@ -81,8 +339,19 @@ def parse_args():
     copy_images.add_argument("-i", "--images", type=str, nargs="+", help="File extensions to search for.", default=list(get_extensions_for_type("image")))
     copy_images.add_argument("-u", "--uuid", action="store_true", help="Generate UUIDv4s for files. Ensures all images are copied.")
     copy_images.add_argument("-r", "--recursive", action="store_true", help="Flag to recursively search directories.")
+    copy_images.add_argument("--index", type=Path, default=None,
+                             help="SQLite index of directory listings, reused between runs.")
     copy_images.add_argument("--dry_run", action="store_true", help="Do not copy, just output mappings.")
-    copy_images.add_argument("-w", "--workers", type=int, default=multiprocessing.cpu_count() - 1,
+    copy_images.add_argument("-m", "--manifest", type=Path, default=None,
+                             help="Manifest of copied files, reruns skip unchanged sources and identical content is "
+                                  "stored once. Default <output>/.copy_manifest.json")
+    copy_images.add_argument("--no_manifest", action="store_true", help="Do not use a manifest, copy by file name.")
+    copy_images.add_argument("--mappings", type=Path, default=None,
+                             help="Write a JSON file mapping every source path to its destination.")
+    copy_images.add_argument("--copy_engine", choices=["fast", "shutil"], default="fast",
+                             help="fast: reflink/copy_file_range/sendfile with preallocation and batched metadata "
+                                  "updates. shutil: shutil.copy2 per file.")
+    copy_images.add_argument("-w", "--workers", type=int, default=max(1, multiprocessing.cpu_count() - 1),
                              help="Specify number of workers.")
     crop_images = subparsers.add_parser("crop_images",
                                         add_help=True,
@@ -92,20 +361,63 @@ def parse_args():
     crop_images.add_argument("-i", "--images", type=str, nargs="+", help="File extensions to search for.", default=list(get_extensions_for_type("image")))
     crop_images.add_argument("-p", "--padding", type=int, default=0, help="Pad the crop.")
     crop_images.add_argument("-r", "--recursive", action="store_true", help="Flag to recursively search directories.")
-    crop_images.add_argument("-w", "--workers", type=int, default=multiprocessing.cpu_count() - 1, help="Specify number of workers.")
+    crop_images.add_argument("--index", type=Path, default=None,
+                             help="SQLite index of directory listings, reused between runs.")
+    crop_images.add_argument("-w", "--workers", type=int, default=max(1, multiprocessing.cpu_count() - 1), help="Specify number of workers.")
     crop_images.add_argument("--dry_run", action="store_true", help="Do not copy, just output mappings.")
+    crop_images.add_argument("--pipeline", action="store_true",
+                             help="Run as a staged pipeline: reader threads, --workers compute processes, writer threads.")
+    crop_images.add_argument("--readers", type=int, default=2, help="Number of reader threads in --pipeline mode.")
+    crop_images.add_argument("--writers", type=int, default=2, help="Number of encoder/writer threads in --pipeline mode.")
+    crop_images.add_argument("--queue_size", type=int, default=64, help="Bound of the queues between pipeline stages.")
+    crop_images.add_argument("--boxes_only", type=Path, default=None,
+                             help="Write the crop boxes to this .json or .parquet manifest instead of cropping.")
+    crop_images.add_argument("-s", "--scale", type=int, choices=[1, 2, 4, 8], default=1,
+                             help="Find the crop box on a 1/scale copy of the image. Default full resolution.")
+    crop_images.add_argument("--lossless", action="store_true",
+                             help="Crop JPEGs losslessly with jpegtran instead of decoding and re-encoding them.")
     detect_anomalies = subparsers.add_parser("detect_anomalies",
                                         add_help=True,
                                         description="Detect anomalies.")
     detect_anomalies.add_argument("folders", type=Path, nargs="+",
                              help="Directories to search through.")
-    detect_anomalies.add_argument("-o", "--output", default="./anomalies.txt", type=Path,
-                             help="File to copy images into. Default ./anomalies.txt")
+    detect_anomalies.add_argument("-o", "--output", default="./anomalies.csv", type=Path,
+                             help="CSV file to write ranked anomaly scores into. Default ./anomalies.csv")
     detect_anomalies.add_argument("-i", "--images", type=str, nargs="+", help="File extensions to search for.",
                              default=list(get_extensions_for_type("image")))
     detect_anomalies.add_argument("-c", "--clusters", type=int, default=10, help="Number of clusters to attempt anomaly detection across.")
-    detect_anomalies.add_argument("--dry_run", action="store_true", help="Do not copy, just output mappings.")
+    detect_anomalies.add_argument("-t", "--threshold", type=float, default=2.5,
+                             help="Distance to the cluster centroid above which an image is an outlier.")
+    detect_anomalies.add_argument("-r", "--recursive", action="store_true", help="Flag to recursively search directories.")
+    detect_anomalies.add_argument("--index", type=Path, default=None,
+                                  help="SQLite index of directory listings, reused between runs.")
+    detect_anomalies.add_argument("-w", "--workers", type=int, default=max(1, multiprocessing.cpu_count() - 1),
+                             help="Specify number of feature extraction processes.")
+    detect_anomalies.add_argument("-b", "--batch_size", type=int, default=1024, help="Images per feature batch.")
+    detect_anomalies.add_argument("--cache", type=Path, default=None, help="Folder to cache features in between runs.")
+    detect_anomalies.add_argument("--checkpoint", type=Path, default=None,
+                             help="Checkpoint file to resume an interrupted run from. Default <output>.checkpoint")
+    detect_anomalies.add_argument("--dry_run", action="store_true", help="Do not extract features, just count images.")
+    convert_coords = subparsers.add_parser("convert_coords",
+                                           add_help=True,
+                                           description="Convert coordinates in CSV or NMEA files in fixed-size chunks.")
+    convert_coords.add_argument("input", type=Path, help="CSV or NMEA file to convert.")
+    convert_coords.add_argument("-o", "--output", type=Path, default=None,
+                                help="CSV file to write. Default <input>_converted.csv")
+    convert_coords.add_argument("-f", "--format", choices=["auto", "csv", "nmea"], default="auto",
+                                help="Input format. Default guessed from the first line.")
+    convert_coords.add_argument("-t", "--to", choices=["dd", "ddm", "dms"], default="dd",
+                                help="Representation to convert to. Default decimal degrees.")
+    convert_coords.add_argument("--lat_column", type=str, default="latitude", help="CSV latitude column name or index.")
+    convert_coords.add_argument("--lon_column", type=str, default="longitude", help="CSV longitude column name or index.")
+    convert_coords.add_argument("-c", "--chunk_size", type=int, default=100000, help="Rows converted per chunk.")
+    convert_coords.add_argument("-w", "--workers", type=int, default=1,
+                                help="Number of worker processes to spread chunks across.")
     args = parent_parser.parse_args()
+    if args.command == "crop_images" and args.pipeline and args.boxes_only is None and \
+            (args.lossless or args.scale != 1):
+        crop_images.error("--pipeline crops at full resolution and re-encodes, it cannot be combined with --lossless "
+                          "or --scale.")
     return args
 
 
@@ -125,40 +437,285 @@ def expand_json_mappings(json_paths: List[Path]):
     return mappings
 
 
-def copy_worker(args: argparse.Namespace):
+# ioctl request to clone (reflink) a whole file on Linux, supported by btrfs, XFS and others.
+FICLONE = 0x40049409
+
+
+def _reflink(fsrc, fdst) -> bool:
+    try:
+        import fcntl
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        return True
+    except (ImportError, OSError):
+        return False
+
+
+def fast_copy(source: os.PathLike, destination: os.PathLike, preallocate: bool = True) -> int:
+    """
+    Copy the data of a file without passing it through Python. Tries a reflink first, then copy_file_range, then
+    sendfile, then falls back to buffered copying. Metadata is not copied, see copy_metadata.
+    :param source: File to copy.
+    :param destination: File to write, overwritten if it exists.
+    :param preallocate: Allocate the full size of the destination up front to reduce fragmentation.
+    :return: Number of bytes copied.
+    """
+    with open(source, "rb") as fsrc, open(destination, "wb") as fdst:
+        size = os.fstat(fsrc.fileno()).st_size
+        if size and _reflink(fsrc, fdst):
+            return size
+        if preallocate and size and hasattr(os, "posix_fallocate"):
+            try:
+                os.posix_fallocate(fdst.fileno(), 0, size)
+            except OSError:
+                pass
+        offset = 0
+        if hasattr(os, "copy_file_range"):
+            try:
+                while offset < size:
+                    copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), size - offset, offset, offset)
+                    if copied == 0:
+                        break
+                    offset += copied
+            except OSError:
+                pass
+        if offset < size and hasattr(os, "sendfile"):
+            try:
+                fdst.seek(offset)
+                while offset < size:
+                    copied = os.sendfile(fdst.fileno(), fsrc.fileno(), offset, size - offset)
+                    if copied == 0:
+                        break
+                    offset += copied
+            except OSError:
+                pass
+        if offset < size:
+            fsrc.seek(offset)
+            fdst.seek(offset)
+            shutil.copyfileobj(fsrc, fdst, 1 << 20)
+        return size
+
+
+def copy_metadata(source_stat: os.stat_result, destination: os.PathLike):
+    """
+    Copy permission bits and access/modification times, like the metadata part of shutil.copy2.
+    """
+    os.chmod(destination, stat.S_IMODE(source_stat.st_mode))
+    os.utime(destination, ns=(source_stat.st_atime_ns, source_stat.st_mtime_ns))
+
+
+class MetadataBatch:
+    def __init__(self):
+        """
+        Metadata updates collected from copy workers and applied together, away from the data copies.
+        """
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def add(self, source_stat: os.stat_result, destination: os.PathLike):
+        with self._lock:
+            self._pending.append((source_stat, destination))
+
+    def __len__(self):
+        return len(self._pending)
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+        for source_stat, destination in pending:
+            copy_metadata(source_stat, destination)
+
+
+def file_hash(path: Path, chunk_size: int = 1 << 20) -> str:
+    """
+    BLAKE2b content hash of a file, read in chunks.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class CopyManifest:
+    def __init__(self, path: Path):
+        """
+        Record of copied files: source path -> size, mtime, content hash and destination, plus content hash ->
+        destination so identical content is only stored once. Safe to share between worker threads.
+        :param path: JSON file the manifest is loaded from (if it exists) and saved to.
+        """
+        self.path = path
+        manifest = expand_json_mappings([path]) if path.exists() else {}
+        self.files = manifest.get("files", {})
+        self.hashes = manifest.get("hashes", {})
+        self._names = {Path(dest).name for dest in self.hashes.values()}
+        self.lock = threading.Lock()
+
+    def unchanged(self, source: Path, stat: os.stat_result) -> Union[str, None]:
+        """
+        :return: The destination of source if it was copied before and its size and mtime have not changed.
+        """
+        with self.lock:
+            entry = self.files.get(str(source))
+        if entry is not None and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+            return entry["dest"]
+        return None
+
+    def reserve(self, content_hash: str, output: Path, name: str) -> Tuple[str, bool]:
+        """
+        Claim a destination for new content, or find the destination it is already stored at.
+        :return: The destination and whether the content still has to be copied there.
+        """
+        with self.lock:
+            if content_hash in self.hashes:
+                return self.hashes[content_hash], False
+            path = Path(name)
+            if name in self._names or output.joinpath(name).exists():
+                # A different file with the same name was copied already.
+                name = f"{path.stem}_{content_hash[:8]}{path.suffix}"
+            self._names.add(name)
+            dest = str(output.joinpath(name))
+            self.hashes[content_hash] = dest
+            return dest, True
+
+    def release(self, content_hash: str):
+        with self.lock:
+            dest = self.hashes.pop(content_hash, None)
+            if dest is not None:
+                self._names.discard(Path(dest).name)
+
+    def record(self, source: Path, stat: os.stat_result, content_hash: str, dest: str):
+        with self.lock:
+            self.files[str(source)] = dict(size=stat.st_size, mtime_ns=stat.st_mtime_ns, hash=content_hash, dest=dest)
+
+    def mappings(self) -> dict:
+        with self.lock:
+            return {source: entry["dest"] for source, entry in self.files.items()}
+
+    def save(self):
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with self.lock, open(tmp_path, "w") as f:
+            json.dump({"files": self.files, "hashes": self.hashes}, f)
+        os.replace(tmp_path, self.path)
+
+
+def copy_worker(args: argparse.Namespace, manifest: Union[CopyManifest, None] = None,
+                metadata: Union[MetadataBatch, None] = None, destinations: Union[dict, None] = None):
+    def copy_file(image_path: Path, output_path: Union[Path, str]):
+        if metadata is None:
+            shutil.copy2(str(image_path), str(output_path))
+        else:
+            fast_copy(image_path, output_path)
+            metadata.add(image_path.stat(), output_path)
+
     def do_work(image_path: Path):
+        start = time.perf_counter()
+        copied = copy_with_manifest(image_path) if manifest is not None else copy_by_name(image_path)
+        if metrics.enabled():
+            size = image_path.stat().st_size if copied and not args.dry_run else 0
+            metrics.record("copy", time.perf_counter() - start, bytes_read=size, bytes_written=size)
+        return copied
+
+    def copy_by_name(image_path: Path):
+        output_path = args.output.joinpath(image_path.name) if not args.uuid else args.output.joinpath(image_path.stem + f"_{uuid.uuid4()}" + image_path.suffix)
         if not args.dry_run:
-            output_path = args.output.joinpath(image_path.name) if not args.uuid else args.output.joinpath(image_path.stem + f"_{uuid.uuid4()}" + image_path.suffix)
             if output_path.exists():
                 if args.verbose:
                     print(f"File exists ", output_path)
-                    return False
+                return False
             if args.verbose:
                 print(f"Copying {image_path} to {output_path}")
-            shutil.copy2(str(image_path), str(output_path))
+            copy_file(image_path, output_path)
+        if destinations is not None:
+            destinations[str(image_path)] = str(output_path)
         return True
+
+    def copy_with_manifest(image_path: Path):
+        stat = image_path.stat()
+        if manifest.unchanged(image_path, stat) is not None:
+            if args.verbose:
+                print(f"Unchanged ", image_path)
+            return False
+        content_hash = file_hash(image_path)
+        name = image_path.name if not args.uuid else image_path.stem + f"_{uuid.uuid4()}" + image_path.suffix
+        dest, new_content = manifest.reserve(content_hash, args.output, name)
+        if new_content and not args.dry_run:
+            if args.verbose:
+                print(f"Copying {image_path} to {dest}")
+            try:
+                copy_file(image_path, dest)
+            except BaseException:
+                manifest.release(content_hash)
+                raise
+        elif args.verbose and not new_content:
+            print(f"Duplicate of {dest} ", image_path)
+        manifest.record(image_path, stat, content_hash, dest)
+        return new_content
     return do_work
 
 
+def _recorded(iterable, out: list):
+    # Pass items through while keeping a list of them.
+    for item in iterable:
+        out.append(item)
+        yield item
+
+
 def copy_images(args: argparse.Namespace):
+    import tqdm
     # Check the output directory exists
     args.output.mkdir(exist_ok=True, parents=True)
     # Create iterator for searching source directories for images
-    image_paths = find_files(args.images, args.folders, args.recursive, args.workers)
+    # Sources are yielded directory by directory in inode order, so copying starts while the scan is still running.
+    sources = discover_files(args)
+    image_paths = []
+    if args.mappings is not None:
+        sources = _recorded(sources, image_paths)
+    manifest = None
+    if not args.no_manifest:
+        manifest = CopyManifest(args.manifest or args.output.joinpath(".copy_manifest.json"))
+    # Without a manifest the destinations of name-based copies are collected for the mappings file.
+    destinations = {} if args.mappings is not None and manifest is None else None
+    metadata = None
+    if args.copy_engine == "fast":
+        metadata = MetadataBatch()
     # Create automatic crops from source to destination
-    with tqdm.tqdm(total=len(image_paths), desc="Copying...") as pbar:
-        with concurrent.futures.ThreadPoolExecutor(max_workers=args.workers) as pool:
-            worker = copy_worker(args)
-            futures = [pool.submit(worker, image_path) for image_path in image_paths]
-            for future in concurrent.futures.as_completed(futures):
-                result = future.result()
+    try:
+        with tqdm.tqdm(desc="Copying...") as pbar:
+            def copied(result):
                 pbar.update(1)
+                if metadata is not None and len(metadata) >= 1024:
+                    metadata.flush()
+
+            run_bounded(copy_worker(args, manifest, metadata, destinations), sources, args.workers, on_result=copied)
             if args.verbose and args.dry_run:
                 print("Dry run complete.")
+    finally:
+        if metadata is not None:
+            metadata.flush()
+        # Keep track of whatever was copied, even if the run was interrupted.
+        if manifest is not None and not args.dry_run:
+            manifest.save()
+    if args.mappings is not None:
+        mappings = manifest.mappings() if manifest is not None else destinations
+        with open(args.mappings, "w") as f:
+            json.dump({source: mappings[source] for source in map(str, image_paths) if source in mappings}, f, indent=1)
 
 
 def crop_worker(args: argparse.Namespace):
+    import cv2
+    from qolhelpers.images import threshold_and_crop, find_crop_box, lossless_jpeg_crop
+
     def do_work(image_path: Path):
+        start = time.perf_counter()
+        cropped = crop(image_path)
+        if metrics.enabled():
+            output_path = args.output.joinpath(image_path.name)
+            written = output_path.stat().st_size if cropped and not args.dry_run else 0
+            metrics.record("crop", time.perf_counter() - start, bytes_read=image_path.stat().st_size,
+                           bytes_written=written)
+        return cropped
+
+    def crop(image_path: Path):
         if not args.dry_run:
             output_path = args.output.joinpath(image_path.name)
             if output_path.exists():
@@ -167,38 +724,554 @@ def crop_worker(args: argparse.Namespace):
                     return False
             if args.verbose:
                 print(f"Cropping {image_path} to {output_path}")
+            if args.lossless and image_path.suffix.lower() in (".jpg", ".jpeg"):
+                lossless_jpeg_crop(image_path, output_path, find_crop_box(image_path, args.padding, args.scale))
+                return True
             img = threshold_and_crop(image_path, args.padding)
             return cv2.imwrite(str(output_path), img)
         return True
     return do_work
 
 
+def crop_box_record(image_path: Path, padding: int = 0, scale: int = 1) -> dict:
+    from qolhelpers.images import find_crop_box
+    x, y, w, h = find_crop_box(image_path, padding, scale)
+    return {"path": str(image_path), "x": x, "y": y, "width": w, "height": h}
+
+
+def write_box_manifest(records: List[dict], path: Path):
+    """
+    Write crop box records as a JSON list, or as a Parquet table if path ends in .parquet (requires pyarrow).
+    """
+    path.parent.mkdir(exist_ok=True, parents=True)
+    if path.suffix == ".parquet":
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("Writing a Parquet manifest requires pyarrow, use a .json manifest instead.")
+        pyarrow.parquet.write_table(pyarrow.Table.from_pylist(records), str(path))
+    else:
+        with open(path, "w") as f:
+            json.dump(records, f, indent=1)
+
+
+def crop_bytes(data: bytes, padding: int):
+    """
+    Compute stage of the crop pipeline: decode an encoded image and crop it. Runs in a worker process.
+    :return: The cropped image and the seconds spent.
+    """
+    import cv2
+    import numpy as np
+    from qolhelpers.images import threshold_and_crop
+    start = time.perf_counter()
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("Could not decode image.")
+    return threshold_and_crop(image, padding), time.perf_counter() - start
+
+
+def _ignore_sigint():
+    # Pool worker initializer: a terminal Ctrl-C reaches the whole process group, leave the shutdown to the parent.
+    import signal
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _put_until(q: queue.Queue, item, stop: threading.Event) -> bool:
+    # Put item on a bounded queue, giving up once stop is set so a blocked producer cannot hang the shutdown.
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def crop_pipeline(image_paths: Iterable[Path], output: Path, padding: int = 0, readers: int = 2, workers: int = 1,
+                  writers: int = 2, queue_size: int = 64, progress=None, verbose: bool = False) -> List[StageStats]:
+    """
+    Crop images with three overlapping stages connected by bounded queues: reader threads load the encoded bytes,
+    a process pool decodes and crops, and writer threads encode and write the results. On Ctrl-C queued images are
+    dropped and writes in progress finish before KeyboardInterrupt propagates.
+    :param image_paths: Images to crop, may be a generator that is still scanning.
+    :param output: Folder to write the crops into. Existing files are skipped.
+    :param padding: Padding passed to threshold_and_crop.
+    :param readers: Number of reader threads.
+    :param workers: Number of compute processes.
+    :param writers: Number of encoder/writer threads.
+    :param queue_size: Maximum number of images waiting between two stages.
+    :param progress: Optional callable run once for every image written or skipped, e.g. tqdm.update.
+    :param verbose: Print skipped files and errors.
+    :return: The StageStats of the read, compute and write stages.
+    """
+    import cv2
+    stats = [StageStats("read", readers), StageStats("compute", workers), StageStats("write", writers)]
+    read_stats, compute_stats, write_stats = stats
+    for stage in stats:
+        metrics.add_stage(stage)
+    read_queue = queue.Queue(maxsize=queue_size)
+    write_queue = queue.Queue(maxsize=queue_size)
+    paths = iter(image_paths)
+    paths_lock = threading.Lock()
+    done = object()
+    stop = threading.Event()
+    # Set when the pool broke, e.g. a worker was killed, so the run stops and reports it.
+    errors = []
+
+    def read():
+        while not stop.is_set():
+            with paths_lock:
+                image_path = next(paths, None)
+            if image_path is None:
+                return
+            output_path = output.joinpath(image_path.name)
+            if output_path.exists():
+                if verbose:
+                    print(f"File exists ", output_path)
+                if progress is not None:
+                    progress(1)
+                continue
+            start = time.perf_counter()
+            try:
+                data = image_path.read_bytes()
+            except OSError as e:
+                print(f"Could not read {image_path}: {e}", file=sys.stderr)
+                if progress is not None:
+                    progress(1)
+                continue
+            read_stats.record(time.perf_counter() - start, bytes_read=len(data))
+            if not _put_until(read_queue, (image_path, output_path, data), stop):
+                return
+            metrics.observe("read_queue", read_queue.qsize())
+
+    def compute():
+        # Keep at most queue_size images inside the pool on top of the queues.
+        slots = threading.Semaphore(queue_size)
+        try:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_ignore_sigint) as pool:
+                while True:
+                    item = read_queue.get()
+                    if item is done:
+                        break
+                    # Keep draining after a stop so readers blocked on the queue can finish.
+                    while not stop.is_set() and not slots.acquire(timeout=0.1):
+                        pass
+                    if stop.is_set():
+                        continue
+                    image_path, output_path, data = item
+                    try:
+                        future = pool.submit(crop_bytes, data, padding)
+                    except concurrent.futures.process.BrokenProcessPool as e:
+                        slots.release()
+                        broken(e)
+                        continue
+                    future.add_done_callback(functools.partial(computed, image_path, output_path, slots))
+                if stop.is_set():
+                    pool.shutdown(wait=True, cancel_futures=True)
+        finally:
+            for _ in range(writers):
+                write_queue.put(done)
+
+    def broken(error: Exception):
+        if not stop.is_set():
+            errors.append(error)
+            stop.set()
+
+    def computed(image_path, output_path, slots, future):
+        slots.release()
+        if stop.is_set():
+            return
+        try:
+            image, seconds = future.result()
+        except concurrent.futures.process.BrokenProcessPool as e:
+            broken(e)
+            return
+        except Exception as e:
+            print(f"Could not crop {image_path}: {e}", file=sys.stderr)
+            image, seconds = None, 0.0
+        compute_stats.record(seconds)
+        write_queue.put((image_path, output_path, image))
+        metrics.observe("write_queue", write_queue.qsize())
+
+    def write():
+        while True:
+            item = write_queue.get()
+            if item is done:
+                return
+            image_path, output_path, image = item
+            if stop.is_set():
+                continue
+            if image is not None:
+                start = time.perf_counter()
+                ok, encoded = cv2.imencode(output_path.suffix, image)
+                if ok:
+                    output_path.write_bytes(encoded.tobytes())
+                else:
+                    print(f"Could not encode {output_path}", file=sys.stderr)
+                write_stats.record(time.perf_counter() - start, bytes_written=encoded.nbytes if ok else 0)
+            if progress is not None:
+                progress(1)
+
+    reader_threads = [threading.Thread(target=read) for _ in range(readers)]
+    compute_thread = threading.Thread(target=compute)
+    writer_threads = [threading.Thread(target=write) for _ in range(writers)]
+    for thread in [*reader_threads, compute_thread, *writer_threads]:
+        thread.start()
+
+    def finish():
+        for thread in reader_threads:
+            thread.join()
+        read_queue.put(done)
+        compute_thread.join()
+        for thread in writer_threads:
+            thread.join()
+
+    try:
+        finish()
+    except BaseException:
+        # Ctrl-C: readers stop and queued images are dropped, writes in progress finish so no file is half written.
+        stop.set()
+        finish()
+        raise
+    if errors:
+        raise errors[0]
+    return stats
+
+
 def crop_images(args: argparse.Namespace):
+    import tqdm
     # Check the output directory exists
     args.output.mkdir(exist_ok=True, parents=True)
     # Create iterator for searching source directories for images
-    image_paths = find_files(args.images, args.folders, args.recursive, args.workers)
-    # Create automatic crops from source to destination
-    with tqdm.tqdm(total=len(image_paths), desc="Cropping...") as pbar:
-        with concurrent.futures.ThreadPoolExecutor(max_workers=args.workers) as pool:
-            worker = crop_worker(args)
-            futures = [pool.submit(worker, image_path) for image_path in image_paths]
-            for future in concurrent.futures.as_completed(futures):
-                result = future.result()
+    image_paths = discover_files(args)
+    if args.boxes_only is not None:
+        records = []
+        with tqdm.tqdm(desc="Finding crop boxes...") as pbar:
+            def found(record):
+                records.append(record)
                 pbar.update(1)
-            if args.verbose and args.dry_run:
-                print("Dry run complete.")
+
+            run_bounded(functools.partial(crop_box_record, padding=args.padding, scale=args.scale), image_paths,
+                        args.workers, on_result=found)
+        write_box_manifest(sorted(records, key=lambda record: record["path"]), args.boxes_only)
+        return
+    if args.pipeline and not args.dry_run:
+        start = time.perf_counter()
+        with tqdm.tqdm(desc="Cropping...") as pbar:
+            stats = crop_pipeline(image_paths, args.output, args.padding, args.readers, args.workers, args.writers,
+                                  args.queue_size, pbar.update, args.verbose)
+        wall_time = time.perf_counter() - start
+        for stage in stats:
+            print(stage.summary(wall_time))
+        return
+    # Create automatic crops from source to destination
+    with tqdm.tqdm(desc="Cropping...") as pbar:
+        # Paths are pulled as crops complete, so cropping overlaps with the directory scan.
+        run_bounded(crop_worker(args), image_paths, args.workers, on_result=lambda result: pbar.update(1))
+        if args.verbose and args.dry_run:
+            print("Dry run complete.")
+
+
+def iter_chunks(iterable, chunk_size: int):
+    """
+    Split an iterable into lists of at most chunk_size items without materialising it.
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def map_bounded(func, iterable, workers: int):
+    """
+    Ordered map over an iterable in worker processes, with at most 2 * workers items in flight so the input is only
+    consumed as fast as results are taken.
+    """
+    if workers <= 1:
+        yield from map(func, iterable)
+        return
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = collections.deque()
+        for item in iterable:
+            pending.append(pool.submit(func, item))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+async def _run_bounded(func, iterable, executor: concurrent.futures.Executor, max_in_flight: int, on_result):
+    import asyncio
+    loop = asyncio.get_running_loop()
+    iterator = iter(iterable)
+    # Finished futures are queued by their done callbacks, so each completion costs O(1) rather than asyncio.wait
+    # re-registering on every pending future.
+    completed = collections.deque()
+    wakeup = asyncio.Event()
+
+    def finished(task):
+        completed.append(task)
+        wakeup.set()
+
+    # Discovery generators block while they list directories, so they are advanced in their own thread, racing the
+    # running work. One thread also keeps the generator from being entered concurrently.
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="discovery") as reader:
+        pending = set()
+        fetch = None
+        exhausted = False
+        count = 0
+        try:
+            while True:
+                if fetch is None and not exhausted and len(pending) < max_in_flight:
+                    # Take as many items as there are free slots, but never wait for more than one when the workers
+                    # are idle, since a slow scan would otherwise hold back items that are already found.
+                    size = max(1, min(len(pending), max_in_flight - len(pending)))
+                    fetch = loop.run_in_executor(reader, _take, iterator, size)
+                    fetch.add_done_callback(finished)
+                if fetch is None and not pending:
+                    return count
+                await wakeup.wait()
+                wakeup.clear()
+                while completed:
+                    task = completed.popleft()
+                    if task is fetch:
+                        batch = fetch.result()
+                        fetch = None
+                        exhausted = not batch
+                        for item in batch:
+                            future = loop.run_in_executor(executor, func, item)
+                            future.add_done_callback(finished)
+                            pending.add(future)
+                        continue
+                    pending.discard(task)
+                    result = task.result()
+                    count += 1
+                    if on_result is not None:
+                        on_result(result)
+        finally:
+            # Cancelled (e.g. Ctrl-C) or failed: drop queued work, let running items finish so no file is half written.
+            for task in pending:
+                task.cancel()
+            executor.shutdown(wait=True, cancel_futures=True)
+            # Close the generator on the thread that ran it: a DirectoryIndex it opened is tied to that thread.
+            reader.submit(_close, iterator).result()
+
+
+def _take(iterator, n: int) -> list:
+    return list(itertools.islice(iterator, n))
+
+
+def _close(iterator):
+    close = getattr(iterator, "close", None)
+    if close is not None:
+        close()
+
+
+def run_bounded(func, iterable, workers: int, max_in_flight: Optional[int] = None, on_result=None,
+                executor: Optional[concurrent.futures.Executor] = None) -> int:
+    """
+    Run func on every item of an iterable in an executor, driven by an asyncio loop that pulls items from the iterable
+    only as work completes. At most max_in_flight items are queued or running at once, so memory does not grow with the
+    number of items, and a discovery generator is consumed as the workers keep up. Results are passed to on_result on
+    the calling thread in completion order; the first exception raised by func stops the run and is re-raised. On
+    Ctrl-C queued items are dropped and running ones finish before KeyboardInterrupt propagates.
+    :param func: Blocking callable run on each item, e.g. a copy or an OpenCV crop.
+    :param iterable: Items to process, may be a generator that is still scanning.
+    :param workers: Number of worker threads, ignored when an executor is given.
+    :param max_in_flight: Maximum number of submitted items not yet handed to on_result. Default 4 * workers, and at
+                          least 64 to amortise the scheduling cost. Queued items only hold their input.
+    :param on_result: Optional callable run with each result, e.g. to update a progress bar.
+    :param executor: Executor to run func in, e.g. a ProcessPoolExecutor. It is shut down when the run ends.
+    :return: The number of items processed.
+    """
+    import asyncio
+    workers = max(1, workers)
+    executor = executor or concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    return asyncio.run(_run_bounded(func, iterable, executor, max(1, max_in_flight or max(64, 4 * workers)), on_result))
+
+
+def _save_checkpoint(path: Path, state: dict):
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp_path, "wb") as f:
+        pickle.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+def detect_anomalies(args: argparse.Namespace):
+    import tqdm
+    from qolhelpers.images import FeatureCache, iter_feature_batches, iter_anomaly_scores, new_anomaly_model, \
+        update_anomaly_model
+    # Sorted so an interrupted run sees the images in the same order when it resumes.
+    image_paths = sorted(discover_files(args))
+    if args.dry_run:
+        print(f"Found {len(image_paths)} images.")
+        return
+    checkpoint = args.checkpoint or args.output.with_name(args.output.name + ".checkpoint")
+    partial = args.output.with_name(args.output.name + ".partial")
+    signature = hashlib.sha1("\n".join(map(str, image_paths)).encode()).hexdigest() + \
+        f"|{args.clusters}|{args.batch_size}"
+    state = None
+    if checkpoint.exists():
+        with open(checkpoint, "rb") as f:
+            state = pickle.load(f)
+        if state["signature"] != signature:
+            print(f"Ignoring checkpoint {checkpoint}, the images or settings have changed.", file=sys.stderr)
+            state = None
+        elif args.verbose:
+            print(f"Resuming {state['phase']} phase after {state['batches']} batches.")
+    if state is None:
+        scaler, kmeans = new_anomaly_model(args.clusters)
+        state = dict(signature=signature, phase="fit", batches=0, scaler=scaler, kmeans=kmeans, partial_size=0)
+    cache = FeatureCache(args.cache) if args.cache is not None else None
+    batch_size = args.batch_size
+
+    with tqdm.tqdm(total=2 * len(image_paths), desc="Detecting anomalies...") as pbar:
+        if state["phase"] == "fit":
+            pbar.update(state["batches"] * batch_size)
+            for paths, features in iter_feature_batches(image_paths[state["batches"] * batch_size:], batch_size,
+                                                        args.workers, cache):
+                start = time.perf_counter()
+                update_anomaly_model(state["scaler"], state["kmeans"], features)
+                metrics.record("fit", time.perf_counter() - start, items=len(paths))
+                state["batches"] += 1
+                _save_checkpoint(checkpoint, state)
+                # Count unreadable images too, they were dropped from the batch.
+                pbar.update(min(batch_size, len(image_paths) - (state["batches"] - 1) * batch_size))
+            state.update(phase="score", batches=0, partial_size=0)
+            _save_checkpoint(checkpoint, state)
+        pbar.n = len(image_paths) + min(state["batches"] * batch_size, len(image_paths))
+        pbar.refresh()
+        # Drop any scores written after the last checkpoint.
+        with open(partial, "a+", newline="") as f:
+            f.truncate(state["partial_size"])
+            writer = csv.writer(f)
+            for paths, scores in iter_anomaly_scores(image_paths[state["batches"] * batch_size:], state["scaler"],
+                                                     state["kmeans"], batch_size, args.workers, cache):
+                writer.writerows(zip(map(str, paths), scores.tolist()))
+                f.flush()
+                state["batches"] += 1
+                state["partial_size"] = f.tell()
+                _save_checkpoint(checkpoint, state)
+                # Count unreadable images too, they were dropped from the batch.
+                pbar.update(min(batch_size, len(image_paths) - (state["batches"] - 1) * batch_size))
+
+    with open(partial, "r", newline="") as f:
+        scores = sorted(((path, float(score)) for path, score in csv.reader(f)), key=lambda row: row[1], reverse=True)
+    args.output.parent.mkdir(exist_ok=True, parents=True)
+    with open(args.output, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["rank", "path", "score", "outlier"])
+        writer.writerows((rank, path, score, int(score > args.threshold))
+                         for rank, (path, score) in enumerate(scores, start=1))
+    partial.unlink()
+    checkpoint.unlink()
+    if args.verbose:
+        print(f"{sum(score > args.threshold for _, score in scores)} outliers written to {args.output}")
+
+
+# NMEA sentence type to the indices of its time, latitude, N/S, longitude and E/W fields.
+NMEA_FIELDS = {"GGA": (1, 2, 3, 4, 5), "RMC": (1, 3, 4, 5, 6), "GLL": (5, 1, 2, 3, 4)}
+
+
+def _format_converted(latlong: "LatLong", representation: str, bad: "np.ndarray"):
+    columns = [column.tolist() for column in latlong.as_columns(representation).values()]
+    rows = [list(row) for row in zip(*columns)]
+    for i in bad:
+        rows[i] = [""] * len(columns)
+    return rows
+
+
+def convert_csv_chunk(rows: List[List[str]], lat_index: int, lon_index: int, representation: str, width: int = 0):
+    import numpy as np
+    from qolhelpers.geo import LatLong, parse_coord_strings
+    # Short rows are padded to width (the header length) and, like unparseable values, get blank output columns.
+    rows = [row + [""] * (width - len(row)) if len(row) < width else row for row in rows]
+    lat, lat_bad = parse_coord_strings([row[lat_index] if lat_index < len(row) else "" for row in rows])
+    lon, lon_bad = parse_coord_strings([row[lon_index] if lon_index < len(row) else "" for row in rows])
+    bad = np.union1d(lat_bad, lon_bad)
+    lat[bad], lon[bad] = 0, 0
+    converted = _format_converted(LatLong(lat, lon, vectorized=True), representation, bad)
+    return [row + columns for row, columns in zip(rows, converted)]
+
+
+def convert_nmea_chunk(lines: List[str], representation: str):
+    import numpy as np
+    from qolhelpers.geo import LatLong, parse_nmea_coords
+    records = []
+    for line in lines:
+        line = line.strip()
+        if not line.startswith("$"):
+            continue
+        fields = line.split("*", 1)[0].split(",")
+        indices = NMEA_FIELDS.get(fields[0][-3:])
+        if indices is None or len(fields) <= max(indices) or not fields[indices[1]] or not fields[indices[3]]:
+            continue
+        records.append([fields[0][1:]] + [fields[i] for i in indices])
+    if not records:
+        return []
+    sentences, times, lats, ns, lons, ew = zip(*records)
+    lat, lon = parse_nmea_coords(lats, ns), parse_nmea_coords(lons, ew)
+    # Garbled fields parse to NaN, their rows get blank output columns.
+    bad = np.flatnonzero(np.isnan(lat) | np.isnan(lon))
+    lat[bad], lon[bad] = 0, 0
+    converted = _format_converted(LatLong(lat, lon, vectorized=True), representation, bad)
+    return [[sentence, time] + columns for sentence, time, columns in zip(sentences, times, converted)]
+
+
+def _column_index(header: List[str], column: str, path: Path) -> int:
+    """
+    Resolve a column given by name or 0-based index against a CSV header.
+    """
+    index = int(column) if column.isdigit() else header.index(column) if column in header else None
+    if index is None or index >= len(header):
+        raise ValueError(f"Column {column} not found in {path}, its columns are {header}.")
+    return index
+
+
+def convert_coords(args: argparse.Namespace):
+    import tqdm
+    from qolhelpers.geo import LatLong
+    output = args.output or args.input.with_name(args.input.stem + "_converted.csv")
+    source_format = args.format
+    if source_format == "auto":
+        with open(args.input, "r") as f:
+            first_line = next((line for line in f if line.strip()), "")
+        source_format = "nmea" if first_line.lstrip().startswith("$") else "csv"
+    column_names = list(LatLong(0.0, 0.0).as_columns(args.to))
+    with open(args.input, "r", newline="") as src, open(output, "w", newline="") as dst:
+        writer = csv.writer(dst)
+        if source_format == "nmea":
+            writer.writerow(["sentence", "time"] + column_names)
+            chunks = iter_chunks(src, args.chunk_size)
+            convert = functools.partial(convert_nmea_chunk, representation=args.to)
+        else:
+            reader = csv.reader(src)
+            header = next(reader, [])
+            lat_index, lon_index = (_column_index(header, column, args.input)
+                                    for column in (args.lat_column, args.lon_column))
+            writer.writerow(header + column_names)
+            chunks = iter_chunks(reader, args.chunk_size)
+            convert = functools.partial(convert_csv_chunk, lat_index=lat_index, lon_index=lon_index,
+                                        representation=args.to, width=len(header))
+        with tqdm.tqdm(desc="Converting...", unit="rows") as pbar:
+            for rows in map_bounded(convert, chunks, args.workers):
+                writer.writerows(rows)
+                pbar.update(len(rows))
+    if args.verbose:
+        print(f"Wrote {output}")
 
 
 if __name__ == "__main__":
     args = parse_args()
-    if args.command == "copy_images":
-        copy_images(args)
-    if args.command == "crop_images":
-        crop_images(args)
-    if args.command == "detect_anomalies":
-        raise NotImplementedError("Anomaly detection requires more work.")
-        # imgs = search4images(args)
-        # outliers = detect_anomalies(imgs, 5)
-        # with open(args.output, "w") as f:
-        #     f.writelines([str(o)+'\n' for o in outliers])
+    with metrics.session(args.metrics, args.metrics_format, args.profile, args.profiler):
+        if args.command == "copy_images":
+            copy_images(args)
+        if args.command == "crop_images":
+            crop_images(args)
+        if args.command == "convert_coords":
+            convert_coords(args)
+        if args.command == "detect_anomalies":
+            detect_anomalies(args)
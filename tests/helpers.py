@@ -0,0 +1,23 @@
+"""
+Test data shared by the test modules.
+"""
+from pathlib import Path
+import cv2
+import numpy as np
+
+
+def write_anomaly_images(directory: Path):
+    """
+    Mostly identical smooth gradients with one noise image (index 7) that should stand out.
+    :return: The paths of the 11 images written.
+    """
+    paths = []
+    gradient = np.tile(np.linspace(0, 255, 128, dtype=np.uint8), (128, 1))
+    for i in range(11):
+        path = directory / f"image_{i:02d}.png"
+        image = np.roll(gradient, i, axis=1)
+        if i == 7:
+            image = np.random.default_rng(0).integers(0, 255, (128, 128), dtype=np.uint8)
+        cv2.imwrite(str(path), image)
+        paths.append(path)
+    return paths
@@ -1,5 +1,7 @@
 import unittest
-from qolhelpers.geo import LatLong
+import numpy as np
+from qolhelpers.geo import LatLong, LatLongIndex, parse_coord_strings, guess_coord_format, EARTH_RADIUS, \
+    haversine_distance, iter_pairwise_distances
 
 
 class TestLatLong(unittest.TestCase):
@@ -108,5 +110,157 @@ class TestLatLong(unittest.TestCase):
         self.assertAlmostEqual(lon_sec, self._lon_dms[2])
 
 
+class TestLatLongVectorized(unittest.TestCase):
+    setUp = TestLatLong.setUp
+
+    def test_storage_is_contiguous_float64(self):
+        latlong = LatLong(self._lats_dd, self._lons_dd, vectorized=True)
+        self.assertEqual(latlong.latitude.dtype, np.float64)
+        self.assertTrue(latlong.latitude.flags["C_CONTIGUOUS"])
+        self.assertEqual(len(latlong), 2)
+
+    def test_string_input(self):
+        latlong = LatLong(np.array(["51° 28' 38.20\"", "-012° 20' 44.44404\""]),
+                          ["-0° 0.0885'", "0° 7.40740734'"], vectorized=True)
+        np.testing.assert_allclose(latlong.latitude, self._lats_dd, atol=1e-5)
+        np.testing.assert_allclose(latlong.longitude, self._lons_dd, atol=1e-5)
+
+    def test_vectorized_decimal_degrees(self):
+        coords = LatLong(self._lats_dd, self._lons_dd, vectorized=True).as_decimal_degrees()
+        np.testing.assert_allclose(coords["latitude"], self._lats_dd)
+        np.testing.assert_allclose(coords["longitude"], self._lons_dd)
+
+    def test_vectorized_degrees_decimal_minutes(self):
+        coords = LatLong(self._lats_dd, self._lons_dd, vectorized=True).as_degrees_decimal_minutes()
+        np.testing.assert_array_equal(coords["latitude"]["deg"], [d for d, _ in self._lats_ddm])
+        np.testing.assert_allclose(coords["latitude"]["min"], [m for _, m in self._lats_ddm], atol=1e-5)
+        np.testing.assert_array_equal(coords["longitude"]["deg"], [d for d, _ in self._lons_ddm])
+        np.testing.assert_allclose(coords["longitude"]["min"], [m for _, m in self._lons_ddm], atol=1e-5)
+
+    def test_vectorized_degrees_minutes_seconds(self):
+        coords = LatLong(self._lats_dd, self._lons_dd, vectorized=True).as_degrees_minutes_seconds()
+        np.testing.assert_array_equal(coords["latitude"]["deg"], [d for d, _, _ in self._lats_dms])
+        np.testing.assert_array_equal(coords["latitude"]["min"], [m for _, m, _ in self._lats_dms])
+        np.testing.assert_allclose(coords["latitude"]["sec"], [s for _, _, s in self._lats_dms], atol=1e-2)
+        np.testing.assert_array_equal(coords["longitude"]["min"], [m for _, m, _ in self._lons_dms])
+        np.testing.assert_allclose(coords["longitude"]["sec"], [s for _, _, s in self._lons_dms], atol=1e-2)
+
+    def test_vectorized_matches_scalar(self):
+        rng = np.random.default_rng(0)
+        lats, lons = rng.uniform(-90, 90, 100), rng.uniform(-180, 180, 100)
+        expected = LatLong(lats.tolist(), lons.tolist()).as_degrees_minutes_seconds()
+        coords = LatLong(lats, lons, vectorized=True).as_degrees_minutes_seconds()
+        for i, ((lat_deg, lat_min, lat_sec), (lon_deg, lon_min, lon_sec)) in enumerate(expected):
+            self.assertEqual(coords["latitude"]["deg"][i], lat_deg)
+            self.assertEqual(coords["latitude"]["min"][i], lat_min)
+            self.assertAlmostEqual(coords["latitude"]["sec"][i], lat_sec)
+            self.assertEqual(coords["longitude"]["deg"][i], lon_deg)
+            self.assertEqual(coords["longitude"]["min"][i], lon_min)
+            self.assertAlmostEqual(coords["longitude"]["sec"][i], lon_sec)
+
+
+class TestParseCoordStrings(unittest.TestCase):
+    def setUp(self) -> None:
+        self._lats_dd = [51.477277777777774, -012.3456789]
+        self._lats_dms = ["51° 28' 38.20\"", "-012° 20' 44.44404\""]
+
+    def test_guess_coord_format(self):
+        self.assertEqual(guess_coord_format("51.4772"), "dd")
+        self.assertEqual(guess_coord_format("51° 28.63667'"), "ddm")
+        self.assertEqual(guess_coord_format("51 28 38.20"), "dms")
+        self.assertIsNone(guess_coord_format("north"))
+
+    def test_string_array_and_bytes_buffer(self):
+        for coords in (self._lats_dms, np.array(self._lats_dms), np.char.encode(np.array(self._lats_dms), "utf-8"),
+                       "\n".join(self._lats_dms).encode("utf-8")):
+            values, bad = parse_coord_strings(coords)
+            np.testing.assert_allclose(values, self._lats_dd, atol=1e-5)
+            self.assertEqual(len(bad), 0)
+
+    def test_negative_zero_degrees(self):
+        values, _ = parse_coord_strings(["-0° 0' 5.31\"", "-0° 0.0885'"])
+        np.testing.assert_allclose(values, [-0.001475, -0.001475], atol=1e-5)
+
+    def test_mixed_formats_keep_row_boundaries(self):
+        for coords, expected in ((["51° 28.5'", "12.5", "3.5"], [51.475, 12.5, 3.5]),
+                                 (["51° 28.5'", "12.5"], [51.475, 12.5])):
+            values, bad = parse_coord_strings(coords)
+            np.testing.assert_allclose(values, expected)
+            self.assertEqual(len(bad), 0)
+
+    def test_reports_bad_rows(self):
+        values, bad = parse_coord_strings(["51.5", "garbage", "51° 28' 38.20\"", ""])
+        np.testing.assert_array_equal(bad, [1, 3])
+        self.assertTrue(np.isnan(values[1]))
+        self.assertAlmostEqual(values[2], self._lats_dd[0], places=5)
+        with self.assertRaises(ValueError):
+            LatLong(["51.5", "garbage"], ["0.1", "0.2"], vectorized=True)
+
+
+class TestLatLongIndex(unittest.TestCase):
+    def setUp(self) -> None:
+        rng = np.random.default_rng(0)
+        self._points = LatLong(rng.uniform(-60, 60, 500), rng.uniform(-180, 180, 500), vectorized=True)
+        self._queries = LatLong(rng.uniform(-60, 60, 20), rng.uniform(-180, 180, 20), vectorized=True)
+
+    def _brute_force(self):
+        lat1, lon1 = np.radians(self._queries.latitude)[:, None], np.radians(self._queries.longitude)[:, None]
+        lat2, lon2 = np.radians(self._points.latitude)[None], np.radians(self._points.longitude)[None]
+        a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+        return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(a))
+
+    def test_knn_matches_brute_force(self):
+        index = LatLongIndex(self._points)
+        distances, indices = index.query(self._queries, k=3)
+        expected = self._brute_force()
+        np.testing.assert_array_equal(indices, np.argsort(expected, axis=1)[:, :3])
+        np.testing.assert_allclose(distances, np.sort(expected, axis=1)[:, :3], rtol=1e-9)
+
+    def test_radius_matches_brute_force(self):
+        index = LatLongIndex(self._points)
+        indices, distances = index.query_radius(self._queries, 1_000_000, return_distance=True)
+        expected = self._brute_force()
+        for i in range(len(self._queries)):
+            np.testing.assert_array_equal(np.sort(indices[i]), np.flatnonzero(expected[i] <= 1_000_000))
+            np.testing.assert_allclose(np.sort(distances[i]), np.sort(expected[i][expected[i] <= 1_000_000]))
+
+
+class TestGeodesicKernels(unittest.TestCase):
+    def setUp(self) -> None:
+        # Flinders Peak and Buninyong, the worked example from Vincenty (1975).
+        self._flinders = LatLong("-37° 57' 3.72030\"", "144° 25' 29.52440\"", vectorized=True)
+        self._buninyong = LatLong("-37° 39' 10.15610\"", "143° 55' 35.38390\"", vectorized=True)
+
+    def test_vincenty(self):
+        distance = self._flinders.distance_to(self._buninyong, method="vincenty")
+        np.testing.assert_allclose(distance, [54972.271], atol=1e-3)
+
+    def test_haversine_and_bearing(self):
+        # One degree of longitude along the equator, heading east.
+        origin = LatLong(0.0, 0.0)
+        self.assertAlmostEqual(float(origin.distance_to(LatLong(0.0, 1.0))), np.radians(1) * EARTH_RADIUS)
+        self.assertAlmostEqual(float(origin.bearing_to(LatLong(0.0, 1.0))), 90.0)
+        self.assertAlmostEqual(float(origin.bearing_to(LatLong(-1.0, 0.0))), 180.0)
+
+    def test_track(self):
+        track = LatLong([0.0, 0.0, 1.0], [0.0, 1.0, 1.0], vectorized=True)
+        step = np.radians(1) * EARTH_RADIUS
+        np.testing.assert_allclose(track.consecutive_distances(), [step, step])
+        np.testing.assert_allclose(track.consecutive_bearings(), [90.0, 0.0], atol=1e-9)
+        np.testing.assert_allclose(track.track_length(cumulative=True), [0.0, step, 2 * step])
+        self.assertAlmostEqual(track.track_length(), 2 * step)
+        np.testing.assert_allclose(track.track_length(method="vincenty"), 111319.49 + 110574.39, atol=1)
+
+    def test_one_to_many_and_pairwise(self):
+        rng = np.random.default_rng(0)
+        points = LatLong(rng.uniform(-80, 80, 50), rng.uniform(-180, 180, 50), vectorized=True)
+        expected = haversine_distance(points.latitude[:, None], points.longitude[:, None],
+                                      points.latitude[None], points.longitude[None])
+        np.testing.assert_allclose(self._flinders.distance_to(points).shape, (50,))
+        np.testing.assert_allclose(points.pairwise_distances(chunk_size=7), expected)
+        blocks = list(iter_pairwise_distances(points, chunk_size=16))
+        self.assertEqual([block.shape for _, block in blocks], [(16, 50), (16, 50), (16, 50), (2, 50)])
+
+
 if __name__ == '__main__':
     unittest.main(argv=['first-arg-is-ignored'], exit=False)
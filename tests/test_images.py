@@ -1,7 +1,16 @@
+import os
+import tempfile
 import unittest
+from pathlib import Path
 import cv2
 import numpy as np
-from qolhelpers.images import threshold_and_crop
+from PIL import Image
+from qolhelpers.images import threshold_and_crop, extract_features, load_images_and_extract_features, FeatureCache, \
+    iter_feature_batches, detect_anomalies, read_grayscale, reduced_decode_factor, hog_batch, extract_features_batch, \
+    load_images_and_extract_features_batched, find_crop_box, lossless_jpeg_crop
+import shutil
+from skimage.feature import hog
+from helpers import write_anomaly_images
 
 
 class TestImagesModule(unittest.TestCase):
@@ -20,6 +29,185 @@ class TestImagesModule(unittest.TestCase):
         # Verify the shape of the cropped image
         self.assertEqual(cropped_image.shape, (141, 141, 3))
 
+    def test_find_crop_box(self):
+        image = np.zeros((400, 400, 3), dtype=np.uint8)
+        cv2.rectangle(image, (100, 120), (199, 259), (255, 255, 255), -1)
+        self.assertEqual(find_crop_box(image, 10), (90, 110, 120, 160))
+        # Reduced boxes are widened by one reduced pixel per side, and out to the 8 pixel grid at scale 8.
+        self.assertEqual(find_crop_box(image, 10, 2), (88, 108, 124, 164))
+        self.assertEqual(find_crop_box(image, 10, 4), (86, 106, 128, 168))
+        self.assertEqual(find_crop_box(image, 10, 8), (78, 102, 140, 180))
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "image.png"
+            cv2.imwrite(str(path), image)
+            self.assertEqual(find_crop_box(path, 0, 4), (96, 116, 108, 148))
+
+    def test_find_crop_box_contains_content_at_odd_sizes(self):
+        # Reduced JPEG decodes round the size up and PNG decodes round it down, neither is exactly 1/scale.
+        for height, width in ((1001, 1001), (997, 1003)):
+            image = np.zeros((height, width, 3), dtype=np.uint8)
+            image[500:, 500:] = 255
+            image[300:340, 700:760] = 255
+            with tempfile.TemporaryDirectory() as tmp:
+                images = [image]
+                for suffix in (".jpg", ".png"):
+                    path = Path(tmp) / f"image{suffix}"
+                    cv2.imwrite(str(path), image)
+                    images.append(path)
+                for source in images:
+                    for scale in (1, 2, 4, 8):
+                        x, y, w, h = find_crop_box(source, 0, scale)
+                        # Contains all content, ends at the image edge and is at most two reduced pixels larger.
+                        self.assertTrue(500 - 2 * scale <= x <= 500 and 300 - 2 * scale <= y <= 300, (source, scale))
+                        self.assertEqual((x + w, y + h), (width, height), (source, scale))
+
+    def test_find_crop_box_ignores_exif_orientation(self):
+        image = np.zeros((200, 400), dtype=np.uint8)
+        image[40:100, 20:120] = 255
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "image.jpg"
+            exif = Image.Exif()
+            exif[0x0112] = 6  # Rotate 90 degrees clockwise for display.
+            Image.fromarray(image).save(path, exif=exif, quality=100)
+            x, y, w, h = find_crop_box(path)
+            self.assertLessEqual(abs(x - 20) + abs(y - 40) + abs(w - 100) + abs(h - 60), 4)
+
+    @unittest.skipUnless(shutil.which("jpegtran"), "jpegtran is not installed")
+    def test_lossless_jpeg_crop(self):
+        image = np.zeros((400, 400, 3), dtype=np.uint8)
+        cv2.rectangle(image, (96, 128), (223, 255), (255, 255, 255), -1)
+        with tempfile.TemporaryDirectory() as tmp:
+            path, output = Path(tmp) / "image.jpg", Path(tmp) / "crop.jpg"
+            cv2.imwrite(str(path), image)
+            lossless_jpeg_crop(path, output, find_crop_box(path))
+            self.assertEqual(cv2.imread(str(output)).shape, (128, 128, 3))
+
+    def test_reduced_decode(self):
+        self.assertEqual(reduced_decode_factor((6000, 4000), (128, 128)), 8)
+        self.assertEqual(reduced_decode_factor((600, 400), (128, 128)), 2)
+        self.assertEqual(reduced_decode_factor((200, 300), (128, 128)), 1)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "image.jpg"
+            cv2.imwrite(str(path), np.full((1200, 1600, 3), 200, dtype=np.uint8))
+            self.assertEqual(read_grayscale(path).shape, (1200, 1600))
+            self.assertEqual(read_grayscale(path, (128, 128)).shape, (150, 200))
+            self.assertEqual(read_grayscale(path, (256, 256)).shape, (300, 400))
+
+    def test_hog_batch_matches_skimage(self):
+        rng = np.random.default_rng(0)
+        images = rng.integers(0, 255, (6, 128, 128), dtype=np.uint8)
+        images[0] = np.tile(np.arange(128, dtype=np.uint8) * 2, (128, 1))
+        expected = np.stack([hog(image, orientations=8, pixels_per_cell=(16, 16), cells_per_block=(1, 1))
+                             for image in images])
+        np.testing.assert_allclose(hog_batch(images), expected, atol=1e-6)
+        np.testing.assert_allclose(hog_batch(images.astype(np.float64)), expected, atol=1e-6)
+        images = rng.integers(0, 255, (2, 100, 130), dtype=np.uint8)
+        np.testing.assert_allclose(hog_batch(images, 9, (8, 8), (3, 3)),
+                                   np.stack([hog(image, 9, (8, 8), (3, 3)) for image in images]), atol=1e-6)
+
+
+class TestFeatureCache(unittest.TestCase):
+    def setUp(self) -> None:
+        self._tmp = tempfile.TemporaryDirectory()
+        self._dir = Path(self._tmp.name)
+        rng = np.random.default_rng(0)
+        self._images = []
+        for i in range(4):
+            path = self._dir / f"image_{i}.png"
+            cv2.imwrite(str(path), rng.integers(0, 255, (160, 200), dtype=np.uint8))
+            self._images.append(path)
+
+    def tearDown(self) -> None:
+        self._tmp.cleanup()
+
+    def test_reruns_only_compute_new_or_changed_files(self):
+        cache = FeatureCache(self._dir / "cache")
+        _, features = load_images_and_extract_features(self._images[:3], cache)
+        self.assertEqual(len(cache), 3)
+        # A fresh cache object reads the index and features back from disk.
+        cache = FeatureCache(self._dir / "cache")
+        for image, fd in zip(self._images[:3], features):
+            np.testing.assert_array_equal(cache.get(image), fd)
+        self.assertIsNone(cache.get(self._images[3]))
+        # Changing a file makes its entry miss, and the old entry is replaced rather than kept.
+        os.utime(self._images[0], ns=(0, 0))
+        self.assertIsNone(cache.get(self._images[0]))
+        _, features = load_images_and_extract_features(self._images, cache)
+        self.assertEqual(len(cache), 4)
+        np.testing.assert_allclose(features[3], extract_features(self._images[3])[1], atol=1e-6)
+
+    def test_unsaved_rows_are_dropped_on_load(self):
+        cache = FeatureCache(self._dir / "cache")
+        cache.put(self._images[0], np.zeros(8))
+        cache.save()
+        # Killed before save(): the row is on disk but not in the index.
+        cache.put(self._images[1], np.ones(8))
+        cache = FeatureCache(self._dir / "cache")
+        self.assertIsNone(cache.get(self._images[1]))
+        cache.put(self._images[2], np.full(8, 2.0))
+        cache.save()
+        cache = FeatureCache(self._dir / "cache")
+        np.testing.assert_array_equal(cache.get(self._images[0]), np.zeros(8))
+        np.testing.assert_array_equal(cache.get(self._images[2]), np.full(8, 2.0))
+        self.assertEqual((self._dir / "cache" / "features.f8").stat().st_size, 2 * 8 * 8)
+
+    def test_eviction_and_invalidation(self):
+        cache = FeatureCache(self._dir / "cache")
+        load_images_and_extract_features(self._images, cache)
+        row_bytes = (self._dir / "cache" / "features.f8").stat().st_size // 4
+        cache.get(self._images[0])
+        cache.max_bytes = 2 * row_bytes
+        cache.save()
+        self.assertEqual(len(cache), 2)
+        self.assertIn(self._images[0], cache)
+        self.assertEqual((self._dir / "cache" / "features.f8").stat().st_size, 2 * row_bytes)
+        np.testing.assert_allclose(cache.get(self._images[0]), extract_features(self._images[0])[1], atol=1e-6)
+        cache.invalidate([self._images[0]])
+        self.assertNotIn(self._images[0], cache)
+        cache.invalidate()
+        self.assertEqual(len(FeatureCache(self._dir / "cache")), 0)
+
+
+class TestStreamingAnomalies(unittest.TestCase):
+    def setUp(self) -> None:
+        self._tmp = tempfile.TemporaryDirectory()
+        self._dir = Path(self._tmp.name)
+        self._images = write_anomaly_images(self._dir)
+
+    def tearDown(self) -> None:
+        self._tmp.cleanup()
+
+    def test_batched_engine(self):
+        expected = np.stack([extract_features(image)[1] for image in self._images])
+        paths, features = extract_features_batch(self._images)
+        self.assertEqual(paths, self._images)
+        np.testing.assert_allclose(features, expected, atol=1e-6)
+        paths, features = load_images_and_extract_features_batched(self._images, batch_size=4, processes=1)
+        np.testing.assert_allclose(features, expected, atol=1e-6)
+
+    def test_feature_batches(self):
+        batches = list(iter_feature_batches(iter(self._images), batch_size=4, processes=1))
+        self.assertEqual([len(paths) for paths, _ in batches], [4, 4, 3])
+        self.assertEqual([features.shape for _, features in batches], [(4, 512), (4, 512), (3, 512)])
+        np.testing.assert_allclose(batches[1][1][0], extract_features(self._images[4])[1], atol=1e-6)
+
+    def test_unreadable_images_are_skipped(self):
+        broken = self._dir / "broken.png"
+        broken.write_bytes(self._images[0].read_bytes()[:40])
+        images = self._images[:2] + [broken] + self._images[2:]
+        batches = list(iter_feature_batches(images, batch_size=3, processes=1))
+        self.assertEqual([len(paths) for paths, _ in batches], [2, 3, 3, 3])
+        self.assertNotIn(broken, batches[0][0])
+        self.assertEqual(batches[0][1].shape, (2, 512))
+        paths, features = load_images_and_extract_features(images, processes=1)
+        self.assertEqual((len(paths), len(features)), (11, 11))
+        self.assertEqual(detect_anomalies(images, n_clusters=2, threshold=10, batch_size=4, processes=1),
+                         [self._images[7]])
+
+    def test_streaming_detect_anomalies(self):
+        outliers = detect_anomalies(self._images, n_clusters=2, threshold=10, batch_size=4, processes=1)
+        self.assertEqual(outliers, [self._images[7]])
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,103 @@
+import argparse
+import json
+import pstats
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+from qolhelpers import metrics
+from qolhelpers.metrics import StageStats, Measured
+from qolhelpers.utils import copy_images
+
+
+def _square(x):
+    return x * x
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self) -> None:
+        self._tmp = tempfile.TemporaryDirectory()
+        self._dir = Path(self._tmp.name)
+
+    def tearDown(self) -> None:
+        metrics.disable()
+        self._tmp.cleanup()
+
+    def test_stage_stats(self):
+        stage = StageStats("copy", workers=2)
+        stage.record(1.0, bytes_read=10, bytes_written=10, worker="a")
+        stage.record(0.5, items=2, bytes_read=5, worker="b")
+        summary = stage.as_dict(wall_time=2.0)
+        self.assertEqual((summary["items"], summary["bytes_read"], summary["bytes_written"]), (3, 15, 10))
+        self.assertAlmostEqual(summary["utilization"], 1.5 / 4)
+        self.assertEqual(summary["worker_utilization"], {"a": 0.5, "b": 0.25})
+        self.assertIn("3 items", stage.summary(2.0))
+
+    def test_disabled_is_a_no_op(self):
+        metrics.record("copy", 1.0)
+        metrics.observe("queue", 1)
+        self.assertIsNone(metrics.active())
+
+    def test_outputs(self):
+        run = metrics.enable()
+        metrics.record("copy", 0.25, bytes_read=100)
+        for depth in (1, 3, 2):
+            metrics.observe("read_queue", depth)
+        summary = json.loads(run.to_json())
+        self.assertEqual(summary["stages"]["copy"]["bytes_read"], 100)
+        self.assertEqual(summary["gauges"]["read_queue"], {"samples": 3, "mean": 2.0, "max": 3, "last": 2})
+        text = run.to_prometheus()
+        self.assertIn('qolhelpers_stage_bytes_read_total{stage="copy"} 100', text)
+        self.assertIn('qolhelpers_gauge_max{name="read_queue"} 3', text)
+        with self.assertRaises(ValueError):
+            run.write(self._dir / "metrics.txt", "xml")
+
+    def test_measured(self):
+        metrics.enable()
+        results = metrics.collect("square", map(Measured(_square), [1, 2, 3]))
+        self.assertEqual(results, [1, 4, 9])
+        self.assertEqual(metrics.active().stages["square"].items, 3)
+
+    def test_session_writes_on_interrupt(self):
+        path = self._dir / "metrics.json"
+        with self.assertRaises(KeyboardInterrupt):
+            with metrics.session(path, "json"):
+                metrics.record("copy", 0.1)
+                raise KeyboardInterrupt
+        self.assertIsNone(metrics.active())
+        self.assertEqual(json.loads(path.read_text())["stages"]["copy"]["items"], 1)
+
+    def test_profilers(self):
+        with metrics.session(profile_path=self._dir / "run.pstats"):
+            sum(range(1000))
+        self.assertGreater(pstats.Stats(str(self._dir / "run.pstats")).total_calls, 0)
+
+        def busy():
+            end = time.perf_counter() + 0.1
+            while time.perf_counter() < end:
+                pass
+
+        with metrics.session(profile_path=self._dir / "run.stacks", profiler="sample"):
+            thread = threading.Thread(target=busy, name="busy-worker")
+            thread.start()
+            thread.join()
+        self.assertIn("busy-worker;", (self._dir / "run.stacks").read_text())
+
+    def test_copy_images(self):
+        source = self._dir / "source"
+        source.mkdir()
+        for i in range(3):
+            source.joinpath(f"{i}.png").write_bytes(b"x" * 100)
+        args = argparse.Namespace(folders=[source], output=self._dir / "out", images=[".png"], uuid=False,
+                                  recursive=False, dry_run=False, manifest=None, no_manifest=True, mappings=None,
+                                  copy_engine="fast", workers=2, verbose=False, index=None)
+        with metrics.session(self._dir / "metrics.json"):
+            copy_images(args)
+        stages = json.loads((self._dir / "metrics.json").read_text())["stages"]
+        self.assertEqual(stages["find"]["items"], 3)
+        self.assertEqual((stages["copy"]["items"], stages["copy"]["bytes_written"]), (3, 300))
+
+
+if __name__ == '__main__':
+    unittest.main(argv=['first-arg-is-ignored'], exit=False)
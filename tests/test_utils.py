@@ -0,0 +1,536 @@
+import argparse
+import csv
+import os
+import signal
+import threading
+import time
+import shutil
+import subprocess
+import sys
+import json
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+import cv2
+import numpy as np
+import qolhelpers.images
+import qolhelpers.utils
+from qolhelpers.utils import convert_coords, detect_anomalies, crop_images, copy_images, fast_copy, find_files, iter_files, \
+    DirectoryIndex, run_bounded, crop_pipeline
+from qolhelpers.images import threshold_and_crop
+from helpers import write_anomaly_images
+
+
+class TestStartup(unittest.TestCase):
+    def test_heavy_imports_are_lazy(self):
+        code = "import sys, qolhelpers.utils; qolhelpers.utils.parse_args(); " \
+               "print(' '.join(m for m in ('cv2', 'numpy', 'sklearn', 'skimage', 'tqdm') if m in sys.modules))"
+        result = subprocess.run([sys.executable, "-c", code, "copy_images", "."], capture_output=True, text=True,
+                                check=True, cwd=Path(__file__).parent.parent)
+        self.assertEqual(result.stdout.strip(), "")
+
+    def test_pipeline_rejects_lossless_and_scale(self):
+        for flags in (["--lossless"], ["--scale", "2"]):
+            with mock.patch("sys.argv", ["utils", "crop_images", ".", "--pipeline", *flags]), \
+                    mock.patch("sys.stderr"), self.assertRaises(SystemExit):
+                qolhelpers.utils.parse_args()
+        # --boxes_only does not crop, so it takes precedence over --pipeline and uses --scale.
+        argv = ["utils", "crop_images", ".", "--pipeline", "--scale", "2", "--boxes_only", "b.json"]
+        with mock.patch("sys.argv", argv):
+            self.assertEqual(qolhelpers.utils.parse_args().scale, 2)
+
+    def test_extensions_are_cached(self):
+        extensions = qolhelpers.utils.get_extensions_for_type("image")
+        self.assertIn(".png", extensions)
+        self.assertIs(qolhelpers.utils.get_extensions_for_type("image"), extensions)
+
+
+class TestRunBounded(unittest.TestCase):
+    def _tracked(self, func):
+        # Wrap func to count calls and the most calls running or queued at once.
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        lock = threading.Lock()
+
+        def wrapper(item):
+            with lock:
+                self.calls += 1
+            return func(item)
+
+        def source(n):
+            for i in range(n):
+                with lock:
+                    self.in_flight += 1
+                    self.max_in_flight = max(self.max_in_flight, self.in_flight)
+                yield i
+
+        def done(result):
+            with lock:
+                self.in_flight -= 1
+        return wrapper, source, done
+
+    def test_results_and_backpressure(self):
+        results = []
+        func, source, done = self._tracked(lambda x: x * x)
+        count = run_bounded(func, source(500), workers=3, max_in_flight=8,
+                            on_result=lambda result: (done(result), results.append(result)))
+        self.assertEqual(count, 500)
+        self.assertEqual(sorted(results), [i * i for i in range(500)])
+        self.assertLessEqual(self.max_in_flight, 8)
+
+    def test_error_stops_run(self):
+        def fail(x):
+            if x == 3:
+                raise ValueError("bad item")
+            return x
+
+        func, source, _ = self._tracked(fail)
+        with self.assertRaises(ValueError):
+            run_bounded(func, source(10000), workers=2, max_in_flight=4)
+        self.assertLess(self.calls, 100)
+
+    @unittest.skipUnless(threading.current_thread() is threading.main_thread(), "SIGINT needs the main thread")
+    def test_ctrl_c_drains_running_work(self):
+        finished = []
+
+        def slow(x):
+            time.sleep(0.01)
+            finished.append(x)
+            return x
+
+        def interrupt(result):
+            if result == 0:
+                signal.raise_signal(signal.SIGINT)
+
+        with self.assertRaises(KeyboardInterrupt):
+            run_bounded(slow, range(1000), workers=2, max_in_flight=4, on_result=interrupt)
+        # Queued items were dropped, and nothing was still running once the interrupt propagated.
+        count = len(finished)
+        self.assertLess(count, 20)
+        time.sleep(0.05)
+        self.assertEqual(len(finished), count)
+
+    def test_generator_closed_on_its_thread(self):
+        threads = []
+
+        def source():
+            try:
+                yield from range(1000)
+            finally:
+                threads.append(threading.current_thread().name)
+
+        def fail(x):
+            raise ValueError("bad item")
+
+        with self.assertRaises(ValueError):
+            run_bounded(fail, source(), workers=2)
+        self.assertEqual(len(threads), 1)
+        self.assertTrue(threads[0].startswith("discovery"))
+
+
+class TestFindFiles(unittest.TestCase):
+    def setUp(self) -> None:
+        self._tmp = tempfile.TemporaryDirectory()
+        self._dir = Path(self._tmp.name)
+        for name in ("a.jpg", "b.png", "c.txt", "sub/d.jpg", "sub/deeper/e.PNG", "sub/deeper/f.png"):
+            path = self._dir.joinpath(name)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(b"")
+
+    def tearDown(self) -> None:
+        self._tmp.cleanup()
+
+    def _names(self, files):
+        return sorted(path.relative_to(self._dir).as_posix() for path in files)
+
+    def test_extensions(self):
+        self.assertEqual(self._names(find_files([".jpg", "png"], [self._dir])), ["a.jpg", "b.png"])
+        self.assertEqual(self._names(find_files(".txt", self._dir)), ["c.txt"])
+
+    def test_recursive(self):
+        self.assertEqual(self._names(find_files([".jpg", ".png"], [self._dir], recursive=True)),
+                         ["a.jpg", "b.png", "sub/d.jpg", "sub/deeper/f.png"])
+
+    def test_files_and_missing_paths(self):
+        paths = [self._dir / "a.jpg", self._dir / "c.txt", self._dir / "missing", self._dir / "sub"]
+        self.assertEqual(self._names(find_files([".jpg"], paths, num_threads=1)), ["a.jpg", "sub/d.jpg"])
+
+    def test_generator(self):
+        files = iter_files([".jpg"], [self._dir], recursive=True)
+        self.assertIn(next(files).name, ("a.jpg", "d.jpg"))
+        self.assertEqual(len(list(files)), 1)
+
+
+class TestDirectoryIndex(TestFindFiles):
+    def setUp(self) -> None:
+        super().setUp()
+        # Keep the database outside the scanned tree so writing it does not change any directory mtimes.
+        self._index_tmp = tempfile.TemporaryDirectory()
+        self._index_path = Path(self._index_tmp.name) / "listing.sqlite"
+
+    def tearDown(self) -> None:
+        super().tearDown()
+        self._index_tmp.cleanup()
+
+    def _index(self):
+        index = DirectoryIndex(self._index_path)
+        # The fixture directories were just created, trust their mtimes anyway.
+        index.MTIME_SLACK_NS = 0
+        return index
+
+    def _touch_directory(self, path, seconds):
+        os.utime(path, ns=(seconds * 10 ** 9, seconds * 10 ** 9))
+
+    def test_matches_find_files(self):
+        with self._index() as index:
+            for extensions in ([".jpg"], [".png", ".txt"]):
+                for recursive in (False, True):
+                    self.assertEqual(self._names(index.find(extensions, [self._dir], recursive)),
+                                     self._names(find_files(extensions, [self._dir], recursive)))
+
+    def test_reuses_unchanged_directories(self):
+        with self._index() as index:
+            self.assertEqual(len(list(index.find(".jpg", self._dir, recursive=True))), 2)
+            self.assertEqual(index.listed, 3)
+        with self._index() as index:
+            self.assertEqual(self._names(index.find(".png", self._dir, recursive=True)), ["b.png", "sub/deeper/f.png"])
+            self.assertEqual((index.listed, index.reused), (0, 3))
+
+    def test_relists_changed_directories(self):
+        with self._index() as index:
+            list(index.find(".jpg", self._dir, recursive=True))
+        self._dir.joinpath("sub", "g.jpg").write_bytes(b"")
+        shutil.rmtree(self._dir / "sub" / "deeper")
+        self._touch_directory(self._dir / "sub", 1000)
+        with self._index() as index:
+            self.assertEqual(self._names(index.find([".jpg", ".png"], self._dir, recursive=True)),
+                             ["a.jpg", "b.png", "sub/d.jpg", "sub/g.jpg"])
+            self.assertEqual(index.listed, 1)
+
+    def test_copy_images_with_index(self):
+        output = self._dir / "out"
+        args = argparse.Namespace(folders=[self._dir], output=output, images=[".jpg"], uuid=False, recursive=True,
+                                  dry_run=False, manifest=None, no_manifest=True, mappings=None, copy_engine="fast",
+                                  workers=2, verbose=False, index=self._index_path)
+        copy_images(args)
+        self.assertEqual(sorted(path.name for path in output.iterdir()), ["a.jpg", "d.jpg"])
+
+
+class TestConvertCoords(unittest.TestCase):
+    def setUp(self) -> None:
+        self._tmp = tempfile.TemporaryDirectory()
+        self._dir = Path(self._tmp.name)
+
+    def tearDown(self) -> None:
+        self._tmp.cleanup()
+
+    def _args(self, input_path, **kwargs):
+        defaults = dict(input=input_path, output=self._dir / "out.csv", format="auto", to="dd",
+                        lat_column="latitude", lon_column="longitude", chunk_size=2, workers=1, verbose=False)
+        defaults.update(kwargs)
+        return argparse.Namespace(**defaults)
+
+    def _read_output(self):
+        with open(self._dir / "out.csv", newline="") as f:
+            return list(csv.reader(f))
+
+    def test_csv_dms_to_dd(self):
+        input_path = self._dir / "in.csv"
+        input_path.write_text("name,latitude,longitude\n"
+                              "a,51° 28' 38.20\",-0° 0' 5.31\"\n"
+                              "b,-012° 20' 44.44404\",0° 7' 24.4444404\"\n"
+                              "c,bad,0.5\n", encoding="utf-8")
+        convert_coords(self._args(input_path))
+        rows = self._read_output()
+        self.assertEqual(rows[0], ["name", "latitude", "longitude", "latitude_deg", "longitude_deg"])
+        self.assertAlmostEqual(float(rows[1][3]), 51.477277777777774, places=5)
+        self.assertAlmostEqual(float(rows[2][4]), 0.123456789, places=5)
+        self.assertEqual(rows[3][3:], ["", ""])
+
+    def test_nmea_to_ddm_with_workers(self):
+        input_path = self._dir / "in.nmea"
+        input_path.write_text("$GPGGA,123519,4807.038,N,01131.000,E,1,08,0.9,545.4,M,46.9,M,,*47\n"
+                              "$GPRMC,123520,A,4807.038,S,01131.000,W,022.4,084.4,230394,003.1,W*6A\n"
+                              "$GPGSV,3,1,11,03,03,111,00,04,15,270,00,06,01,010,00,13,06,292,00*74\n")
+        convert_coords(self._args(input_path, to="ddm", chunk_size=1, workers=2))
+        rows = self._read_output()
+        self.assertEqual(rows[0], ["sentence", "time", "latitude_deg", "latitude_min", "longitude_deg",
+                                   "longitude_min"])
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[1][:3], ["GPGGA", "123519", "48"])
+        self.assertAlmostEqual(float(rows[1][3]), 7.038, places=6)
+        self.assertEqual(rows[2][2], "-48")
+        self.assertAlmostEqual(float(rows[2][5]), -31.0, places=6)
+
+
+    def test_short_csv_row_gets_blank_columns(self):
+        input_path = self._dir / "in.csv"
+        input_path.write_text("name,latitude,longitude\n"
+                              "a,51.5,0.25\n"
+                              "b,52.5\n"
+                              "c,53.5,1.25\n", encoding="utf-8")
+        convert_coords(self._args(input_path))
+        rows = self._read_output()
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(rows[2], ["b", "52.5", "", "", ""])
+        self.assertEqual([float(value) for value in rows[3][3:]], [53.5, 1.25])
+
+    def test_missing_column(self):
+        input_path = self._dir / "in.csv"
+        input_path.write_text("name,lat,lon\na,51.5,0.25\n", encoding="utf-8")
+        with self.assertRaisesRegex(ValueError, "Column latitude not found"):
+            convert_coords(self._args(input_path))
+        with self.assertRaisesRegex(ValueError, "Column 5 not found"):
+            convert_coords(self._args(input_path, lat_column="1", lon_column="5"))
+
+    def test_garbled_nmea_field_gets_blank_columns(self):
+        input_path = self._dir / "in.nmea"
+        input_path.write_text("$GPGGA,123519,4807.038,N,01131.000,E,1,08,0.9,545.4,M,46.9,M,,*47\n"
+                              "$GPGGA,123520,48O7.038,N,01131.000,E,1,08,0.9,545.4,M,46.9,M,,*47\n"
+                              "$GPGGA,123521,4807.038,N,01131.000,E,1,08,0.9,545.4,M,46.9,M,,*47\n")
+        convert_coords(self._args(input_path))
+        rows = self._read_output()
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(rows[2], ["GPGGA", "123520", "", ""])
+        self.assertAlmostEqual(float(rows[3][2]), 48.1173, places=4)
+
+
+class TestDetectAnomalies(unittest.TestCase):
+    def setUp(self) -> None:
+        self._tmp = tempfile.TemporaryDirectory()
+        self._dir = Path(self._tmp.name)
+        (self._dir / "images").mkdir()
+        write_anomaly_images(self._dir / "images")
+
+    def tearDown(self) -> None:
+        self._tmp.cleanup()
+
+    def _args(self, output):
+        return argparse.Namespace(folders=[self._dir / "images"], output=output, images=[".png"], clusters=2,
+                                  threshold=10, recursive=False, workers=1, batch_size=4, cache=None,
+                                  checkpoint=None, dry_run=False, verbose=False)
+
+    def _read_output(self, output):
+        with open(output, newline="") as f:
+            return list(csv.DictReader(f))
+
+    def test_unreadable_image_is_skipped(self):
+        (self._dir / "images" / "image_99.png").write_bytes(b"\x89PNG\r\n\x1a\n truncated")
+        output = self._dir / "anomalies.csv"
+        detect_anomalies(self._args(output))
+        rows = self._read_output(output)
+        self.assertEqual(len(rows), 11)
+        self.assertEqual(Path(rows[0]["path"]).name, "image_07.png")
+
+    def test_ranked_scores(self):
+        output = self._dir / "anomalies.csv"
+        detect_anomalies(self._args(output))
+        rows = self._read_output(output)
+        self.assertEqual(len(rows), 11)
+        self.assertEqual(Path(rows[0]["path"]).name, "image_07.png")
+        self.assertEqual([row["outlier"] for row in rows], ["1"] + ["0"] * 10)
+        self.assertEqual(sorted(float(row["score"]) for row in rows)[::-1], [float(row["score"]) for row in rows])
+        self.assertFalse((self._dir / "anomalies.csv.checkpoint").exists())
+
+    def test_resume_after_interrupt(self):
+        expected = self._dir / "expected.csv"
+        detect_anomalies(self._args(expected))
+
+        def interrupt_after_first_batch(func):
+            def wrapper(*args, **kwargs):
+                generator = func(*args, **kwargs)
+                yield next(generator)
+                raise KeyboardInterrupt
+            return wrapper
+
+        # Interrupt once in the fitting pass and once in the scoring pass.
+        output = self._dir / "anomalies.csv"
+        for name in ("iter_feature_batches", "iter_anomaly_scores"):
+            with mock.patch.object(qolhelpers.images, name, interrupt_after_first_batch(getattr(qolhelpers.images, name))):
+                with self.assertRaises(KeyboardInterrupt):
+                    detect_anomalies(self._args(output))
+            self.assertTrue((self._dir / "anomalies.csv.checkpoint").exists())
+        detect_anomalies(self._args(output))
+        self.assertEqual(self._read_output(output), self._read_output(expected))
+
+class TestCropImages(unittest.TestCase):
+    def setUp(self) -> None:
+        self._tmp = tempfile.TemporaryDirectory()
+        self._dir = Path(self._tmp.name)
+        (self._dir / "images").mkdir()
+        self._images = []
+        for i in range(6):
+            image = np.zeros((200, 240, 3), dtype=np.uint8)
+            cv2.rectangle(image, (20 + 10 * i, 30), (120 + 10 * i, 150), (255, 255, 255), -1)
+            path = self._dir / "images" / f"image_{i}.png"
+            cv2.imwrite(str(path), image)
+            self._images.append(path)
+        (self._dir / "images" / "broken.png").write_bytes(b"not an image")
+        self._broken = self._dir / "images" / "broken.png"
+
+    def tearDown(self) -> None:
+        self._tmp.cleanup()
+
+    def _args(self, **kwargs):
+        defaults = dict(folders=[self._dir / "images"], output=self._dir / "crops", images=[".png"], padding=5,
+                        recursive=False, workers=1, dry_run=False, verbose=False, pipeline=False, readers=2,
+                        writers=2, queue_size=2, boxes_only=None, scale=1, lossless=False)
+        defaults.update(kwargs)
+        return argparse.Namespace(**defaults)
+
+    def test_pipeline(self):
+        crop_images(self._args(pipeline=True))
+        for path in self._images:
+            expected = threshold_and_crop(path, 5)
+            np.testing.assert_array_equal(cv2.imread(str(self._dir / "crops" / path.name)), expected)
+        self.assertFalse((self._dir / "crops" / "broken.png").exists())
+
+    def test_pipeline_decodes_like_imread(self):
+        # 16 bit and alpha images are decoded to 8 bit BGR by both paths, so the crops match.
+        self._broken.unlink()
+        image = np.zeros((200, 240, 4), dtype=np.uint16)
+        cv2.rectangle(image, (40, 30), (140, 150), (65535, 65535, 65535, 65535), -1)
+        path = self._dir / "images" / "deep.png"
+        cv2.imwrite(str(path), image)
+        crop_images(self._args(pipeline=True))
+        np.testing.assert_array_equal(cv2.imread(str(self._dir / "crops" / path.name)), threshold_and_crop(path, 5))
+
+    @unittest.skipUnless(threading.current_thread() is threading.main_thread(), "SIGINT needs the main thread")
+    def test_pipeline_ctrl_c(self):
+        self._broken.unlink()
+        image = cv2.imread(str(self._images[0]))
+        for i in range(200):
+            cv2.imwrite(str(self._dir / "images" / f"copy_{i}.png"), image)
+        written = []
+
+        def interrupt(n):
+            written.append(n)
+            if len(written) == 1:
+                # Like a terminal Ctrl-C, which Linux delivers to the main thread, blocked in join.
+                signal.pthread_kill(threading.main_thread().ident, signal.SIGINT)
+
+        threads = threading.active_count()
+        self._dir.joinpath("crops").mkdir()
+        with self.assertRaises(KeyboardInterrupt):
+            crop_pipeline(sorted(self._dir.joinpath("images").iterdir()), self._dir / "crops", 5, queue_size=2,
+                          progress=interrupt)
+        self.assertEqual(threading.active_count(), threads)
+        self.assertLess(len(list(self._dir.joinpath("crops").iterdir())), 100)
+
+    @unittest.skipUnless(hasattr(os, "killpg"), "needs process groups")
+    def test_pipeline_ctrl_c_process_group(self):
+        # A terminal Ctrl-C reaches every process in the group, the pool workers included. Run in a new session so the
+        # signal only reaches the pipeline and its workers.
+        self._broken.unlink()
+        image = cv2.imread(str(self._images[0]))
+        for i in range(200):
+            cv2.imwrite(str(self._dir / "images" / f"copy_{i}.png"), image)
+        code = "import os, signal, sys\n" \
+               "from pathlib import Path\n" \
+               "from qolhelpers.utils import crop_pipeline\n" \
+               "images, output = Path(sys.argv[1]), Path(sys.argv[2])\n" \
+               "written = []\n" \
+               "def interrupt(n):\n" \
+               "    written.append(n)\n" \
+               "    if len(written) == 1:\n" \
+               "        os.killpg(0, signal.SIGINT)\n" \
+               "try:\n" \
+               "    crop_pipeline(sorted(images.iterdir()), output, 5, workers=2, queue_size=2, progress=interrupt)\n" \
+               "except KeyboardInterrupt:\n" \
+               "    print('interrupted')\n"
+        for run in range(5):
+            output = self._dir / f"crops_{run}"
+            output.mkdir()
+            result = subprocess.run([sys.executable, "-c", code, str(self._dir / "images"), str(output)],
+                                    capture_output=True, text=True, timeout=60, start_new_session=True,
+                                    cwd=Path(__file__).parent.parent)
+            self.assertEqual(result.stdout.strip(), "interrupted", result.stderr)
+            self.assertLess(len(list(output.iterdir())), 100)
+
+    def test_boxes_only_manifest(self):
+        self._broken.unlink()
+        manifest = self._dir / "boxes.json"
+        crop_images(self._args(boxes_only=manifest, scale=2))
+        with open(manifest) as f:
+            records = {Path(record["path"]).name: record for record in json.load(f)}
+        self.assertEqual(len(records), 6)
+        self.assertEqual(list(self._dir.joinpath("crops").iterdir()), [])
+        # The box found at half resolution contains the full resolution crop, widened by a reduced pixel per side.
+        record = records["image_2.png"]
+        self.assertEqual((record["x"], record["y"]), (33, 23))
+        self.assertTrue(115 <= record["width"] <= 117 and 135 <= record["height"] <= 137)
+
+
+class TestCopyImages(unittest.TestCase):
+    def setUp(self) -> None:
+        self._tmp = tempfile.TemporaryDirectory()
+        self._dir = Path(self._tmp.name)
+        for folder in ("a", "b"):
+            (self._dir / folder).mkdir()
+        (self._dir / "a" / "one.png").write_bytes(b"one")
+        (self._dir / "a" / "two.png").write_bytes(b"two")
+        # Same content as a/one.png under another name, and different content under the same name.
+        (self._dir / "b" / "copy_of_one.png").write_bytes(b"one")
+        (self._dir / "b" / "two.png").write_bytes(b"another two")
+
+    def tearDown(self) -> None:
+        self._tmp.cleanup()
+
+    def _args(self, **kwargs):
+        defaults = dict(folders=[self._dir / "a", self._dir / "b"], output=self._dir / "out", images=[".png"],
+                        uuid=False, recursive=False, dry_run=False, workers=1, verbose=False, manifest=None,
+                        no_manifest=False, mappings=self._dir / "mappings.json", copy_engine="fast")
+        defaults.update(kwargs)
+        return argparse.Namespace(**defaults)
+
+    def _mappings(self):
+        with open(self._dir / "mappings.json") as f:
+            return {Path(source).relative_to(self._dir).as_posix(): Path(dest).name for source, dest in json.load(f).items()}
+
+    def test_deduplication_and_mappings(self):
+        copy_images(self._args())
+        mappings = self._mappings()
+        self.assertEqual(mappings["a/one.png"], mappings["b/copy_of_one.png"])
+        self.assertNotEqual(mappings["a/two.png"], mappings["b/two.png"])
+        self.assertEqual(len(list((self._dir / "out").glob("*.png"))), 3)
+        self.assertEqual({(self._dir / "out" / mappings[source]).read_bytes() for source in ("a/two.png", "b/two.png")},
+                         {b"two", b"another two"})
+
+    def test_mappings_without_manifest(self):
+        copy_images(self._args(uuid=True, no_manifest=True))
+        mappings = self._mappings()
+        self.assertEqual(len(mappings), 4)
+        self.assertEqual((self._dir / "out" / mappings["b/two.png"]).read_bytes(), b"another two")
+        self.assertFalse((self._dir / "out" / ".copy_manifest.json").exists())
+
+    def test_rerun_skips_unchanged_files(self):
+        copy_images(self._args(uuid=True))
+        before = sorted(path.name for path in (self._dir / "out").glob("*.png"))
+        with mock.patch("qolhelpers.utils.fast_copy") as copy:
+            copy_images(self._args(uuid=True))
+            copy.assert_not_called()
+        self.assertEqual(sorted(path.name for path in (self._dir / "out").glob("*.png")), before)
+        # A changed source is copied again, under a new name since its old destination holds the old content.
+        (self._dir / "a" / "one.png").write_bytes(b"changed one")
+        copy_images(self._args())
+        mappings = self._mappings()
+        self.assertEqual((self._dir / "out" / mappings["a/one.png"]).read_bytes(), b"changed one")
+        self.assertEqual((self._dir / "out" / mappings["b/copy_of_one.png"]).read_bytes(), b"one")
+
+    def test_fast_copy_preserves_data_and_metadata(self):
+        source = self._dir / "a" / "large.png"
+        source.write_bytes(np.random.default_rng(0).bytes(3 << 20))
+        os.utime(source, ns=(1_000_000_000, 2_000_000_000))
+        self.assertEqual(fast_copy(source, self._dir / "plain.png"), 3 << 20)
+        self.assertEqual((self._dir / "plain.png").read_bytes(), source.read_bytes())
+        for engine in ("fast", "shutil"):
+            output = self._dir / engine
+            copy_images(self._args(output=output, copy_engine=engine, no_manifest=True))
+            self.assertEqual((output / "large.png").read_bytes(), source.read_bytes())
+            self.assertEqual((output / "large.png").stat().st_mtime_ns, 2_000_000_000)
+
+
+if __name__ == '__main__':
+    unittest.main()